@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import pysam
+
+import flaimapper
+from flaimapper.BAMParser import read_span
+
+from benchmarks.synthetic import SyntheticAlignment
+
+
+def decode_blocks(reads):
+    """
+    The former decoding: read.blocks for the check and for both ends.
+    """
+    spans = []
+    for read in reads:
+        if len(read.blocks) > 0:
+            spans.append((read.blocks[0][0], read.blocks[-1][1] - 1))
+
+    return spans
+
+
+def decode_read_span(reads):
+    spans = []
+    for read in reads:
+        span = read_span(read)
+        if span is not None:
+            spans.append(span)
+
+    return spans
+
+
+def load_reads(alignment_file, n):
+    """
+    Returns the first n alignments of alignment_file, so that only the
+    decoding is timed and not the reading of the BAM file.
+    """
+    reads = []
+    with pysam.AlignmentFile(alignment_file, 'rb') as fh:
+        for read in fh.fetch(until_eof=True):
+            reads.append(read)
+            if len(reads) >= n:
+                break
+
+    return reads
+
+
+def run(alignment_file, n=1000000, repeats=3):
+    """
+    Decodes the first n alignments of alignment_file with read.blocks
+    and with read_span, checks that both give the same spans and
+    returns per decoder the wall times of all runs, the best one and
+    the reads per second of the best run.
+    """
+    reads = load_reads(alignment_file, n)
+    results = {}
+    spans = {}
+
+    for name, decoder in [('blocks', decode_blocks), ('read_span', decode_read_span)]:
+        runs = []
+        for i in range(repeats):
+            t = time.perf_counter()
+            spans[name] = decoder(reads)
+            runs.append(time.perf_counter() - t)
+
+        results[name] = {'best': min(runs), 'runs': runs, 'reads_per_second': len(reads) / min(runs) if min(runs) > 0 else float('nan')}
+
+    if spans['blocks'] != spans['read_span']:
+        raise ValueError("read_span and read.blocks give different spans")
+
+    counts = {'reads': len(reads), 'aligned': len(spans['blocks'])}
+
+    return results, counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the decoding of the read spans: read.blocks versus read_span, in reads per second")
+
+    parser.add_argument("-o", "--output", help="JSON file to write the results to; '-' for stdout", default="-")
+    parser.add_argument("-n", "--repeats", help="number of runs per decoder (default=3)", type=int, default=3)
+    parser.add_argument("--reads", help="number of alignments to decode (default=1000000)", type=int, default=1000000)
+    parser.add_argument("--alignment", help="decode an existing BAM file instead of a synthetic one")
+    parser.add_argument("--seed", help="synthetic: random seed (default=1)", type=int, default=1)
+
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.alignment is not None:
+            alignment_file = args.alignment
+            dataset = {'alignment': os.path.abspath(alignment_file)}
+        else:
+            # Reads of one reference sequence; the depth follows from --reads
+            synthetic = SyntheticAlignment(chromosomes=1, chromosome_length=100000, clusters=20, depth=max(1, args.reads // 20), seed=args.seed)
+            alignment_file = synthetic.write(os.path.join(tmp_dir, 'synthetic.bam'))
+            dataset = {'synthetic': synthetic.parameters()}
+
+        results, counts = run(alignment_file, args.reads, args.repeats)
+
+    report = {'flaimapper': flaimapper.__version__,
+              'python': platform.python_version(),
+              'pysam': pysam.__version__,
+              'platform': platform.platform(),
+              'dataset': dataset,
+              'repeats': args.repeats,
+              'counts': counts,
+              'results': results}
+
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=4, sort_keys=True)
+            fh.write("\n")
+
+    for name in ['blocks', 'read_span']:
+        sys.stderr.write("%-10s %12.0f reads/s\n" % (name, results[name]['reads_per_second']))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy
+import pysam
+
+import flaimapper
+from flaimapper.BAMParser import BAMParser
+from flaimapper.CLI import CLI
+from flaimapper.FlaiMapper import FlaiMapper
+from flaimapper.FragmentWriter import GTFWriter
+from flaimapper.FragmentWriter import TableWriter
+
+from benchmarks.synthetic import SyntheticAlignment
+
+
+def best_of(repeats, function):
+    """
+    Runs function repeats times and returns its (last) result and the
+    wall times of all runs.
+    """
+    runs = []
+    for i in range(repeats):
+        t = time.perf_counter()
+        result = function()
+        runs.append(time.perf_counter() - t)
+
+    return result, runs
+
+
+def bench_regions(settings):
+    fm = FlaiMapper(settings)
+    regions = list(fm.regions())
+    fm.pool.close()
+
+    return regions
+
+
+def bench_bamparser(settings, regions, spans=True):
+    """
+    Parses the reads of all regions and returns their number: with
+    spans, through BAMParser.parse_spans (used by MaskedRegion and the
+    multi-sample counting), otherwise one read at the time through
+    BAMParser.parse_reads.
+    """
+    fm = FlaiMapper(settings)
+    alignment = fm.pool.get(settings.alignment_file)
+
+    n = 0
+    for region in regions:
+        parser = BAMParser(region.region, alignment, settings.read_weight)
+        if spans:
+            for start, stop, count in parser.parse_spans():
+                n += count
+        else:
+            for read in parser.parse_reads():
+                n += 1
+
+    fm.pool.close()
+
+    return n
+
+
+def bench_steps(regions):
+    """
+    Runs the four steps of MaskedRegion.predict_fragments for all
+    regions and returns the fragments and the total time per step.
+    """
+    timings = {'step_01__parse_stats': 0.0, 'step_02__find_peaks': 0.0, 'step_03__smooth_filter_peaks': 0.0, 'step_04__assemble_fragments': 0.0}
+    fragments = []
+
+    for region in regions:
+        t = time.perf_counter()
+        start_positions, stop_positions, start_avg_lengths, stop_avg_lengths = region.step_01__parse_stats()
+        timings['step_01__parse_stats'] += time.perf_counter() - t
+
+        t = time.perf_counter()
+        start_positions = region.step_02__find_peaks(start_positions)
+        stop_positions = region.step_02__find_peaks(stop_positions)
+        timings['step_02__find_peaks'] += time.perf_counter() - t
+
+        t = time.perf_counter()
+        start_positions = region.step_03__smooth_filter_peaks(start_positions)
+        stop_positions = region.step_03__smooth_filter_peaks(stop_positions)
+        timings['step_03__smooth_filter_peaks'] += time.perf_counter() - t
+
+        t = time.perf_counter()
+        fragments.append((region, list(region.step_04__assemble_fragments(start_positions, stop_positions, start_avg_lengths, stop_avg_lengths))))
+        timings['step_04__assemble_fragments'] += time.perf_counter() - t
+
+    return fragments, timings
+
+
+def bench_output(settings, fragments, file_format):
+    if file_format == 1:
+        writer = TableWriter(os.devnull, settings.fasta_handle)
+    else:
+        writer = GTFWriter(os.devnull, settings.offset5p, settings.offset3p)
+
+    for region, region_fragments in fragments:
+        writer.write(region.region, region_fragments)
+
+    writer.close()
+
+    return writer.fragments
+
+
+def run(alignment_file, repeats=3, extra_args=None):
+    """
+    Times the hot paths of FlaiMapper on alignment_file and returns the
+    results as dict: per benchmark the wall times of all runs and the
+    best one.
+    """
+    settings = CLI((extra_args if extra_args is not None else []) + [alignment_file])
+    results = {}
+
+    def add(name, runs):
+        results[name] = {'best': min(runs), 'runs': runs}
+
+    regions, runs = best_of(repeats, lambda: bench_regions(settings))
+    add('FlaiMapper.regions', runs)
+
+    reads, runs = best_of(repeats, lambda: bench_bamparser(settings, regions))
+    add('BAMParser.parse_spans', runs)
+
+    reads, runs = best_of(repeats, lambda: bench_bamparser(settings, regions, False))
+    add('BAMParser.parse_reads', runs)
+
+    step_runs = {}
+    for i in range(repeats):
+        fragments, timings = bench_steps(list(bench_regions(settings)))
+        for step, duration in timings.items():
+            step_runs.setdefault(step, []).append(duration)
+    for step in sorted(step_runs.keys()):
+        add('MaskedRegion.' + step, step_runs[step])
+
+    size, runs = best_of(repeats, lambda: bench_output(settings, fragments, 2))
+    add('output.gtf', runs)
+
+    size, runs = best_of(repeats, lambda: bench_output(settings, fragments, 1))
+    add('output.table', runs)
+
+    counts = {'regions': len(regions),
+              'reads': reads,
+              'fragments': sum(len(region_fragments) for region, region_fragments in fragments)}
+
+    return results, counts
+
+
+def compare(results, baseline):
+    """
+    Returns lines with the relative change of the best times in
+    results compared to those of baseline (earlier benchmark output).
+    """
+    lines = []
+    for name in sorted(results.keys()):
+        if name in baseline:
+            ratio = results[name]['best'] / baseline[name]['best'] if baseline[name]['best'] > 0 else float('nan')
+            lines.append("%-45s %10.4fs %10.4fs %+8.1f%%" % (name, baseline[name]['best'], results[name]['best'], 100.0 * (ratio - 1.0)))
+
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the hot paths of FlaiMapper on a synthetic or given alignment and writes the timings as JSON")
+
+    parser.add_argument("-o", "--output", help="JSON file to write the results to; '-' for stdout", default="-")
+    parser.add_argument("-n", "--repeats", help="number of runs per benchmark (default=3)", type=int, default=3)
+    parser.add_argument("--compare", help="JSON file of an earlier benchmark (e.g. of another version) to compare with")
+    parser.add_argument("--alignment", help="benchmark an existing indexed BAM file instead of a synthetic one")
+    parser.add_argument("--single-pass", help="benchmark with --single-pass", action="store_true", default=False)
+
+    parser.add_argument("--chromosomes", help="synthetic: number of reference sequences (default=2)", type=int, default=2)
+    parser.add_argument("--chromosome-length", help="synthetic: length of the reference sequences (default=100000)", type=int, default=100000)
+    parser.add_argument("--clusters", help="synthetic: precursors per reference sequence (default=20)", type=int, default=20)
+    parser.add_argument("--depth", help="synthetic: reads per precursor (default=1000)", type=int, default=1000)
+    parser.add_argument("--fragments", help="synthetic: fragments per precursor (default=3)", type=int, default=3)
+    parser.add_argument("--spread", help="synthetic: maximal deviation in bp of the read starts and stops (default=2)", type=int, default=2)
+    parser.add_argument("--seed", help="synthetic: random seed (default=1)", type=int, default=1)
+
+    args = parser.parse_args(argv)
+
+    # Per-region debug messages would dominate the timings
+    logging.disable(logging.INFO)
+
+    extra_args = ['--single-pass'] if args.single_pass else []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.alignment is not None:
+            alignment_file = args.alignment
+            dataset = {'alignment': os.path.abspath(alignment_file)}
+        else:
+            synthetic = SyntheticAlignment(args.chromosomes, args.chromosome_length, args.clusters, args.depth, args.fragments, args.spread, args.seed)
+            alignment_file = synthetic.write(os.path.join(tmp_dir, 'synthetic.bam'))
+            dataset = {'synthetic': synthetic.parameters()}
+
+        results, counts = run(alignment_file, args.repeats, extra_args)
+
+    report = {'flaimapper': flaimapper.__version__,
+              'python': platform.python_version(),
+              'numpy': numpy.__version__,
+              'pysam': pysam.__version__,
+              'platform': platform.platform(),
+              'dataset': dataset,
+              'single_pass': args.single_pass,
+              'repeats': args.repeats,
+              'counts': counts,
+              'results': results}
+
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=4, sort_keys=True)
+            fh.write("\n")
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as fh:
+            baseline = json.load(fh)
+
+        if baseline['dataset'] != report['dataset'] or baseline['counts'] != report['counts']:
+            sys.stderr.write("Warning: the benchmarks were run on different data\n")
+
+        sys.stderr.write("%-45s %11s %11s %9s\n" % ('', baseline['flaimapper'], report['flaimapper'], 'change'))
+        for line in compare(results, baseline['results']):
+            sys.stderr.write(line + "\n")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
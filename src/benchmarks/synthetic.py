@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import random
+
+import pysam
+
+
+class SyntheticAlignment:
+    """Generates a deterministic, sorted and indexed BAM file with
+    clusters of small RNA-seq reads, for benchmarking.
+
+    Every reference sequence gets `clusters` evenly spaced precursors.
+    Every precursor carries `fragments` fragments (18-30bp) of which
+    `depth` reads are drawn in total; the start and stop of every read
+    deviate at most `spread` bp from those of its fragment.
+    """
+    def __init__(self, chromosomes=2, chromosome_length=100000, clusters=20, depth=1000, fragments=3, spread=2, seed=1):
+        self.chromosomes = chromosomes
+        self.chromosome_length = chromosome_length
+        self.clusters = clusters
+        self.depth = depth
+        self.fragments = fragments
+        self.spread = spread
+        self.seed = seed
+
+    def parameters(self):
+        return {'chromosomes': self.chromosomes,
+                'chromosome_length': self.chromosome_length,
+                'clusters': self.clusters,
+                'depth': self.depth,
+                'fragments': self.fragments,
+                'spread': self.spread,
+                'seed': self.seed}
+
+    def references(self):
+        return ['chr' + str(i + 1) for i in range(self.chromosomes)]
+
+    def alignments(self):
+        """
+        Returns the (reference id, start, length) of all reads, sorted
+        by coordinate.
+        """
+        rng = random.Random(self.seed)
+        distance = self.chromosome_length // (self.clusters + 1)
+        if distance < 100 + 2 * self.spread:
+            raise ValueError("too many clusters for a reference sequence of %i bp" % self.chromosome_length)
+
+        reads = []
+        for tid in range(self.chromosomes):
+            for i in range(self.clusters):
+                precursor = (i + 1) * distance - 50
+
+                fragments = []
+                for j in range(self.fragments):
+                    length = rng.randint(18, 30)
+                    fragments.append((precursor + rng.randint(0, 100 - length), length))
+
+                for j in range(self.depth):
+                    start, length = rng.choice(fragments)
+                    start_offset = rng.randint(-self.spread, self.spread)
+                    stop_offset = rng.randint(-self.spread, self.spread)
+
+                    reads.append((tid, start + start_offset, max(1, length - start_offset + stop_offset)))
+
+        reads.sort()
+        return reads
+
+    def write(self, filename):
+        """
+        Writes the reads to filename (BAM) and indexes it.
+        """
+        rng = random.Random(self.seed)
+        header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+                  'SQ': [{'SN': name, 'LN': self.chromosome_length} for name in self.references()]}
+
+        with pysam.AlignmentFile(filename, 'wb', header=header) as fh:
+            for k, read in enumerate(self.alignments()):
+                segment = pysam.AlignedSegment()
+                segment.query_name = 'read_' + str(k)
+                segment.flag = 0
+                segment.reference_id = read[0]
+                segment.reference_start = read[1]
+                segment.mapping_quality = 255
+                segment.cigarstring = str(read[2]) + 'M'
+                segment.query_sequence = ''.join(rng.choice('ACGT') for _ in range(read[2]))
+                segment.query_qualities = pysam.qualitystring_to_array('I' * read[2])
+
+                fh.write(segment)
+
+        pysam.index(filename)
+
+        return filename
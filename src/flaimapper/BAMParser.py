@@ -37,27 +37,206 @@
 """
 
 
+import re
+
 import pysam
 
 
+def index_read_counts(alignment_file):
+    """
+    Returns {reference: number of mapped reads} from the index of an
+    opened alignment file, or None if the index has no statistics (e.g.
+    for SAM files).
+    """
+    try:
+        statistics = alignment_file.get_index_statistics()
+    except (ValueError, AttributeError):
+        return None
+
+    return {stat.contig: stat.mapped for stat in statistics}
+
+
+def read_span(read):
+    """
+    Returns the first and last reference position of the aligned blocks
+    of a read, i.e. (read.blocks[0][0], read.blocks[-1][1] - 1), or None
+    if the read has no aligned blocks.
+
+    Building read.blocks creates a list of tuples per read, while
+    reference_start and reference_end are plain integers. These are the
+    ends of the blocks unless the CIGAR begins or ends (apart from clips
+    and insertions) with a deletion or skip. The blocks are therefore
+    only built for reads of which the aligned length on the reference
+    differs from that on the read, i.e. reads with deletions or skips
+    (spliced reads) that are not exactly balanced by insertions.
+    Soft-clipped reads take the cheap path. Reads spanning at most one
+    reference position take the blocks too: pysam reports an end of
+    start + 1 for reads without any aligned base but with one query base
+    (e.g. 1I or 2S1I), which have no blocks.
+    """
+    end = read.reference_end
+    if end is None:  # no CIGAR, e.g. unmapped reads
+        return None
+
+    start = read.reference_start
+    if end - start > 1 and end - start == read.query_alignment_length:
+        return start, end - 1
+
+    blocks = read.blocks
+    if len(blocks) > 0:
+        return blocks[0][0], blocks[-1][1] - 1
+
+    return None
+
+
+class ReadWeight:
+    """Number of reads an alignment stands for, for alignments of
+    collapsed reads (identical reads merged into one record with a
+    count). The count is taken from an integer tag of the alignment
+    (--weight-tag) and/or from the '_x123' suffix of the read name
+    (--weight-name), as in SSLMParser. Alignments without a count
+    weigh 1.
+    """
+    regex_name = re.compile("^(.*?)_x([0-9]+)$")
+
+    def __init__(self, tag=None, name_suffix=False):
+        self.tag = tag
+        self.name_suffix = name_suffix
+
+    def __call__(self, read):
+        if self.tag is not None and read.has_tag(self.tag):
+            return int(read.get_tag(self.tag))
+
+        if self.name_suffix:
+            m = self.regex_name.match(read.query_name)
+            if m:
+                return int(m.group(2))
+
+        return 1
+
+    def __str__(self):
+        return "weight-tag:%s\tweight-name:%s" % (self.tag, self.name_suffix)
+
+
+class AlignmentFilePool:
+    """Keeps one shared pysam handle per alignment file, so that the
+    BAM header and index are read once per run instead of once per
+    region. The number of opened handles is counted in self.opens.
+    """
+    def __init__(self):
+        self.handles = {}
+        self.opens = 0
+
+    def open(self, filename):
+        """Opens a new, private handle (e.g. for region discovery, which
+        can not share a handle with the per-region parsers).
+        """
+        self.opens += 1
+        return pysam.AlignmentFile(filename, 'rb')
+
+    def get(self, filename, sample=None):
+        """Returns the shared handle of filename. Samples that are read
+        side by side get a handle per sample, also if they are the same
+        file, because the iterators of one handle can not be interleaved.
+        """
+        key = filename if sample is None else (filename, sample)
+        if key not in self.handles:
+            self.handles[key] = self.open(filename)
+
+        return self.handles[key]
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+
+        self.handles = {}
+
+
 class BAMParser:
     """parseNcRNA is a class that parses the BAM alignment files using pysam.
+
+    The alignment can be given as filename, or as an already opened
+    pysam.AlignmentFile (e.g. from an AlignmentFilePool). With a
+    ReadWeight, parse_spans() gives the number of reads of collapsed
+    alignments.
     """
-    def __init__(self, region, alignment):
+    def __init__(self, region, alignment, weight=None):
         self.region = region
-        self.alignment = pysam.AlignmentFile(alignment, 'rb')
+        self.weight = weight
+
+        if isinstance(alignment, pysam.AlignmentFile):
+            self.alignment = alignment
+        else:
+            self.alignment = pysam.AlignmentFile(alignment, 'rb')
 
     def parse_reads(self):
         if(self.region[0] in self.alignment.references):
             for read in self.alignment.fetch(self.region[0], self.region[1], self.region[2]):
-
-                if len(read.blocks) > 0:  # ensure the read is acutally aligned
-                    # First coordinate is given at 0 base, the second as 1
-                    # Therefore the second is converted with "-1"
-                    yield (read.blocks[0][0], read.blocks[-1][1] - 1)
+                span = read_span(read)
+                if span is not None:  # ensure the read is acutally aligned
+                    yield span
         else:
             raise Exception("Call to non-existing region")
 
+    def parse_spans(self):
+        """
+        Yields (start, stop, count) for every distinct span, where count
+        is the number of reads (or the sum of their weights, with a
+        ReadWeight) with that span.
+
+        The alignment is sorted by reference_start, and the span of a
+        read never starts before it. It starts later if the CIGAR begins
+        with a deletion or skip, so such spans are kept apart (in later)
+        until the reads of their start position have been counted.
+        """
+        if(self.region[0] not in self.alignment.references):
+            raise Exception("Call to non-existing region")
+
+        weight = self.weight
+        current = None
+        stops = {}
+        later = {}
+
+        for read in self.alignment.fetch(self.region[0], self.region[1], self.region[2]):
+            # read_span(), inlined for the common case
+            start = read.reference_start
+            stop = read.reference_end
+
+            if start != current:
+                for run_stop, count in stops.items():
+                    yield current, run_stop, count
+
+                current = start
+                stops = {}
+
+                if len(later) > 0:
+                    for span in sorted(later):
+                        if span[0] > start:
+                            break
+                        elif span[0] == start:
+                            stops[span[1]] = later.pop(span)
+                        else:
+                            yield span[0], span[1], later.pop(span)
+
+            if stop is None or stop - start <= 1 or stop - start != read.query_alignment_length:
+                span = read_span(read)
+                if span is None:  # ensure the read is acutally aligned
+                    continue
+                elif span[0] != start:
+                    later[span] = later.get(span, 0) + (weight(read) if weight is not None else 1)
+                    continue
+                stop = span[1]
+            else:
+                stop -= 1
+
+            stops[stop] = stops.get(stop, 0) + (weight(read) if weight is not None else 1)
+
+        for stop, count in stops.items():
+            yield current, stop, count
+
+        for span in sorted(later):
+            yield span[0], span[1], later[span]
+
     def __iter__(self):
         for read in self.parse_reads():
             yield read
@@ -46,8 +46,16 @@ import pysam
 import flaimapper
 
 
+def output_format(value):
+    """
+    Numbered formats are given as int, others (e.g. 'gtf.gz') as str.
+    """
+    return int(value) if value.isdigit() else value
+
+
 def CLI(argv=None):
     from flaimapper.FilterParameters import FilterParameters
+    from flaimapper.BAMParser import ReadWeight
 
     parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, epilog="Further details can be found in the manual:\n<" + flaimapper.__homepage__ + ">")
 
@@ -61,14 +69,37 @@ def CLI(argv=None):
     parser.add_argument("-p", "--parameters", required=False, help="File containing the filtering parameters, using default if none is provided")
 
     parser.add_argument("-o", "--output", help="output filename; '-' for stdout", default="-")
-    parser.add_argument("-f", "--format", help="file format of the output: [1: table; per fragment], [2: GTF (default)]", type=int, choices=range(1, 2 + 1), default=2)
+    parser.add_argument("-f", "--format", help="file format of the output: [1: table; per fragment], [2: GTF (default)], [gtf.gz: coordinate-sorted, BGZF-compressed GTF with tabix index; the output filename must end with '.gz'], [3: NumPy .npz columns; per fragment]", type=output_format, choices=[1, 2, 'gtf.gz', 3], default=2)
 
     parser.add_argument("-r", "--fasta", help="Single reference FASTA file (+faid index) containing all genomic reference sequences")
+    parser.add_argument("--fasta-cache", help="Number of region sequences kept in memory for extracting the fragment sequences from --fasta (default=1)", type=int, default=1)
 
     parser.add_argument("--offset5p", help="Offset in bp added to the exon-type annotations in the GTF file. This offset is used in tools estimating the expression levels (default=4)", type=int, default=4)
     parser.add_argument("--offset3p", help="Offset in bp added to the exon-type annotations in the GTF file. This offset is used in tools estimating the expression levels (default=4)", type=int, default=4)
 
-    parser.add_argument("alignment_file", help="indexed SAM or BAM file", nargs=1)
+    parser.add_argument("--weight-tag", help="For alignments of collapsed reads: integer tag holding the number of reads of an alignment (e.g. 'XC'); alignments without the tag count as 1")
+    parser.add_argument("--weight-name", help="For alignments of collapsed reads: take the number of reads of an alignment from the '_x123' suffix of the read name; alignments without it count as 1", action="store_true", default=False)
+
+    parser.add_argument("--single-pass", help="Collect the read statistics while discovering the regions, so that every alignment is decoded only once", action="store_true", default=False)
+
+    parser.add_argument("-t", "--threads", help="Number of processes used to predict the fragments of the regions in parallel (default=1)", type=int, default=1)
+
+    parser.add_argument("--region", help="Only analyse the given reference sequence. Can be given multiple times to run a shard of the alignment, of which the outputs can be combined with 'flaimapper merge'", action="append", default=None)
+    parser.add_argument("--contigs-from", help="Only analyse the reference sequences listed in this file (one name per line)")
+
+    parser.add_argument("--memory-budget", help="Memory in MB for the read statistics of a single region; the reads of a region are then counted in chunks and statistics that do not fit are kept in memory-mapped files in --spill-dir (default: no limit)", type=float, default=None)
+    parser.add_argument("--spill-dir", help="Directory for the memory-mapped read statistics of regions exceeding --memory-budget (default: the system temporary directory)", default=None)
+
+    parser.add_argument("--cache", help="Directory in which the read statistics and peaks of every region are cached, so that reruns on the same alignment(s) do not read them again")
+
+    parser.add_argument("--region-index", help="File to store the discovered regions in; if it exists and was made for the same alignment(s), padding and references, the regions are read from it instead of walking the alignment")
+
+    parser.add_argument("--profile-stages", help="Write the wall time of every step and the number of reads, peaks and fragments per region to this file (TSV, or JSON if it ends with '.json')", default=None)
+    parser.add_argument("--profile-top", help="Number of slowest regions summarized in the --profile-stages report (default=10)", type=int, default=10)
+
+    parser.add_argument("--support-matrix", help="With multiple alignment files: file to write the reads supporting every fragment per sample to (default: <output>.support.tsv)")
+
+    parser.add_argument("alignment_file", help="indexed SAM or BAM file; if multiple files (samples) are given, one annotation is made over all samples", nargs="+")
 
     # Parse parameters
     if argv is None:
@@ -76,7 +107,19 @@ def CLI(argv=None):
     else:  # Argumented parameters (only for testing)
         args = parser.parse_args(argv)
 
-    args.alignment_file = args.alignment_file[0]
+    args.alignment_files = args.alignment_file
+    args.alignment_file = args.alignment_files[0]
+
+    if len(args.alignment_files) > 1 and args.support_matrix is None:
+        if args.output == '-':
+            parser.error("--support-matrix is required when multiple alignment files are written to stdout")
+        args.support_matrix = args.output + '.support.tsv'
+
+    if args.format == 'gtf.gz' and not args.output.endswith('.gz'):
+        parser.error("the output filename must end with '.gz' when using --format gtf.gz")
+
+    if args.format == 3 and args.output == '-':
+        parser.error("the columnar output (--format 3) can not be written to stdout")
 
     if args.fasta is not None:
         args.fasta_handle = pysam.Fastafile(args.fasta)
@@ -85,6 +128,44 @@ def CLI(argv=None):
 
     args.parameters = FilterParameters(args.parameters)
 
+    if args.weight_tag is not None or args.weight_name:
+        args.read_weight = ReadWeight(args.weight_tag, args.weight_name)
+    else:
+        args.read_weight = None
+
+    # Set verbosity and logging
+    if args.verbose:
+        logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
+        logging.info("Verbose output.")
+    elif args.quiet:
+        logging.basicConfig(format=flaimapper.__log_format__, level=logging.CRITICAL)
+    else:
+        logging.basicConfig(format=flaimapper.__log_format__, level=logging.INFO)
+
+    return args
+
+
+def CLI_merge(argv=None):
+    parser = argparse.ArgumentParser(prog="flaimapper merge", description="Merges the outputs of sharded runs (--region / --contigs-from) into the output of a single run")
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("-v", "--verbose", action="store_true", default=False)
+    group.add_argument("-q", "--quiet", action="store_false", default=True)
+
+    parser.add_argument("-o", "--output", help="output filename; '-' for stdout", default="-")
+    parser.add_argument("-f", "--format", help="file format of the partial outputs: [1: table; per fragment], [2: GTF (default)]", type=int, choices=range(1, 2 + 1), default=2)
+
+    parser.add_argument("alignment_file", help="indexed SAM or BAM file the partial outputs were generated from; determines the order of the references", nargs=1)
+    parser.add_argument("partial_outputs", help="outputs of the sharded runs", nargs="+")
+
+    # Parse parameters
+    if argv is None:
+        args = parser.parse_args()
+    else:  # Argumented parameters (only for testing)
+        args = parser.parse_args(argv)
+
+    args.alignment_file = args.alignment_file[0]
+
     # Set verbosity and logging
     if args.verbose:
         logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
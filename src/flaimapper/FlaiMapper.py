@@ -40,36 +40,250 @@ import pysam
 
 import flaimapper
 import logging
-import sys
-
+import copy
+import collections
+import multiprocessing
+
+from .BAMParser import AlignmentFilePool
+from .BAMParser import BAMParser
+from .BAMParser import index_read_counts
+from .FragmentStore import FragmentStore
+from .FragmentWriter import GTFWriter
+from .FragmentWriter import TableWriter
+from .FragmentWriter import TabixGTFWriter
+from .FragmentWriter import ColumnarWriter
 from .MaskedRegion import MaskedRegion
+from .RegionCache import RegionCache
+from .RegionIndex import RegionIndex
+from .StageProfiler import StageProfiler
 
 
 logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
 
 
+worker = {}
+
+
+def init_worker(settings):
+    """Initializes a worker process of the region scheduler with its
+    own alignment handle.
+    """
+    worker['settings'] = settings
+    worker['pool'] = AlignmentFilePool()
+
+
+def predict_region(region, spans):
+    masked_region = MaskedRegion(region, worker['settings'], spans, worker['pool'])
+    fragments = list(masked_region)
+
+    return fragments, masked_region.profile
+
+
+class SpanClusters:
+    """Groups the spans of reads into clusters [first start, last stop]:
+    a span that starts at most left + right padding after the last stop
+    of the current cluster extends it, otherwise it starts a new one.
+    Spans within the current cluster leave it unchanged.
+
+    Used for the regions of FlaiMapper and MultiSampleFlaiMapper, which
+    are the clusters padded by region().
+    """
+    def __init__(self, left_padding, right_padding):
+        self.i_dist_l = abs(left_padding)
+        self.i_dist_r = abs(right_padding)
+
+    def clusters(self, spans, count=False):
+        """
+        Yields (cluster, counts) for spans, an iterable of (start, stop,
+        count) ordered by start, such as BAMParser.parse_spans. With
+        count, counts is the {(start, stop): count} of the spans in the
+        cluster, otherwise it is empty.
+        """
+        i_dist = self.i_dist_l + self.i_dist_r
+        ss = None
+        counts = {}
+
+        for start, stop, n in spans:
+            if ss is None:
+                ss = [start, stop]
+            elif stop > ss[1]:
+                if start - ss[1] <= i_dist:
+                    ss[1] = stop
+                else:
+                    yield ss, counts
+
+                    ss = [start, stop]
+                    counts = {}
+
+            if count:
+                counts[(start, stop)] = counts.get((start, stop), 0) + n
+
+        if ss is not None:
+            yield ss, counts
+
+    def groups(self, items):
+        """
+        Yields (cluster, items) for items (start, stop, ...) ordered by
+        start, clustered as by clusters(), with the list of the items in
+        every cluster.
+        """
+        i_dist = self.i_dist_l + self.i_dist_r
+        ss = None
+        group = []
+
+        for item in items:
+            if ss is None:
+                ss = [item[0], item[1]]
+            elif item[1] > ss[1]:
+                if item[0] - ss[1] <= i_dist:
+                    ss[1] = item[1]
+                else:
+                    yield ss, group
+
+                    ss = [item[0], item[1]]
+                    group = []
+
+            group.append(item)
+
+        if ss is not None:
+            yield ss, group
+
+    def region(self, s_name, ss):
+        """
+        Returns the region (reference, start, end) of cluster ss, padded
+        by the filter distances.
+        """
+        return (s_name, max(0, ss[0] - self.i_dist_l - 1), max(0, ss[1] + self.i_dist_r + 1))
+
+
 class FlaiMapper():
     def __init__(self, settings):
         logging.info('Initiated FlaiMapper Object')
 
         self.settings = settings
+        self.pool = AlignmentFilePool()
         self.check_alignment_index()
 
+        if self.settings.cache is not None:
+            self.settings.region_cache = RegionCache(self.settings.cache, self.settings.alignment_files, self.settings.parameters, self.settings.read_weight)
+        else:
+            self.settings.region_cache = None
+
     def check_alignment_index(self):
-        self.alignment_file = pysam.AlignmentFile(self.settings.alignment_file, 'rb')
+        self.alignment_file = self.open_indexed(self.settings.alignment_file)
+
+    def open_indexed(self, filename):
+        """
+        Opens the alignment file, and indexes it first if needed.
+        """
+        alignment_file = self.pool.open(filename)
         try:
-            self.alignment_file.fetch()
+            alignment_file.fetch()
         except Exception:
-            logging.info('Indexing BAM file: ' + self.settings.alignment_file)
-            pysam.index(self.settings.alignment_file)
-            self.alignment_file = pysam.AlignmentFile(self.settings.alignment_file, 'rb')
+            logging.info('Indexing BAM file: ' + filename)
+            pysam.index(filename)
+            alignment_file = self.pool.open(filename)
 
         try:
-            self.alignment_file.fetch()
+            alignment_file.fetch()
         except Exception:
-            raise Exception('Couldn\'t indexing BAM file with samtools: ' + self.settings.alignment_file.filename + '\nAre you sure samtools is installed?\n')
+            raise Exception('Couldn\'t indexing BAM file with samtools: ' + filename + '\nAre you sure samtools is installed?\n')
+
+        return alignment_file
+
+    def references(self):
+        """
+        Returns the names of the reference sequences to analyse, in the
+        order of the alignment header. If a shard is given with --region
+        and/or --contigs-from, only those references are analysed.
+        """
+        contigs = set()
+        if self.settings.region is not None:
+            contigs.update(self.settings.region)
+
+        if self.settings.contigs_from is not None:
+            with open(self.settings.contigs_from, 'r') as fh:
+                for line in fh:
+                    line = line.strip()
+                    if len(line) > 0 and line[0] != '#':
+                        contigs.add(line)
+
+        available = self.available_references()
+
+        if self.settings.region is None and self.settings.contigs_from is None:
+            return available
+
+        for contig in sorted(contigs):
+            if contig not in available:
+                raise ValueError("Reference sequence not present in alignment file: " + contig)
+
+        return [s_name for s_name in available if s_name in contigs]
+
+    def available_references(self):
+        return list(self.alignment_file.references)
+
+    def reference_read_counts(self):
+        return index_read_counts(self.alignment_file)
+
+    def work_references(self):
+        """
+        Returns the references in which regions are discovered. Those
+        without mapped reads according to the statistics of the index
+        are skipped. With --threads N > 1 they are ordered by their
+        number of reads, largest first, so that the workers get the
+        longest jobs first; predict() restores the order of the output.
+        """
+        references = self.references()
+        counts = self.reference_read_counts()
+        if counts is None:
+            return references
+
+        work = [s_name for s_name in references if counts.get(s_name, 0) > 0]
+        logging.debug(" - Skipping %i of %i reference sequence(s) without reads" % (len(references) - len(work), len(references)))
+
+        if self.settings.threads > 1:
+            work.sort(key=lambda s_name: counts[s_name], reverse=True)
+
+        return work
+
+    def in_work_order(self, regions):
+        """
+        Sorts (reference, start, end) tuples, e.g. from a region index,
+        by the order of work_references().
+        """
+        rank = {s_name: i for i, s_name in enumerate(self.work_references())}
+
+        return sorted(regions, key=lambda region: rank.get(region[0], len(rank)))
 
     def regions(self):
+        """
+        Yields the regions as MaskedRegion. With --region-index they are
+        taken from the index if it is up to date, and otherwise
+        discovered and written to the index.
+        """
+        index = self.region_index()
+        if index is not None:
+            regions = index.load()
+            if regions is not None:
+                for region in self.in_work_order(regions):
+                    yield MaskedRegion(region, self.settings, None, self.pool)
+                return
+
+        regions = []
+        for masked_region in self.discover_regions():
+            regions.append(masked_region.region)
+            yield masked_region
+
+        if index is not None:
+            index.save(regions)
+
+    def region_index(self):
+        if self.settings.region_index is None:
+            return None
+
+        return RegionIndex(self.settings.region_index, self.settings.alignment_files, self.settings.parameters, self.references())
+
+    def discover_regions(self):
         """
         Needs to find chunks of all consequently aligned blocks (+left
         and right padding distance of the filter)
@@ -83,87 +297,196 @@ class FlaiMapper():
           [------------]                   [-------------]
 
         two regions to be yielded
+
+        The clusters are found on the distinct (start, stop) spans of the
+        reads. In single-pass mode (--single-pass) their counts are kept
+        for the regions, so every alignment is decoded only once.
         """
 
-        i_dist_l = abs(self.settings.parameters.left_padding)
-        i_dist_r = abs(self.settings.parameters.right_padding)
-        i_dist = i_dist_l + i_dist_r
+        clusters = SpanClusters(self.settings.parameters.left_padding, self.settings.parameters.right_padding)
 
-        for i in range(self.alignment_file.nreferences):
-            s_name = self.alignment_file.references[i]
-            ss = [None, None]
+        for s_name in self.work_references():
+            for ss, ss_spans in clusters.clusters(self.reference_spans(s_name), self.settings.single_pass):
+                yield self.masked_region(clusters.region(s_name, ss), ss_spans)
 
-            for r in self.alignment_file.fetch(s_name):
-                if len(r.blocks) > 0:
-                    if ss[0] is None:
-                        ss = [r.blocks[0][0], r.blocks[-1][1] - 1]
-                    else:
-                        if r.blocks[-1][1] - 1 > ss[1]:
-                            if r.blocks[0][0] - ss[1] <= i_dist:
-                                m = max(ss[1], r.blocks[-1][1] - 1)
-                                ss[1] = m
-                            else:
-                                yield MaskedRegion((s_name, max(0, ss[0] - i_dist_l - 1), max(0, ss[1] + i_dist_r + 1)), self.settings)
+    def reference_spans(self, s_name):
+        """
+        Returns the (start, stop, count) of the distinct spans of the
+        reads of reference s_name, ordered by start. With --cache they
+        are taken from the cache if present, and stored otherwise, so a
+        rerun does not decode the alignment to discover the regions.
+        """
+        cache = self.settings.region_cache
+        counts = cache.load_spans(self.settings.alignment_file, s_name) if cache is not None else None
+
+        if counts is None:
+            region = (s_name, 0, self.alignment_file.get_reference_length(s_name))
+            spans = BAMParser(region, self.alignment_file, self.settings.read_weight).parse_spans()
+            if cache is None:
+                return spans
+
+            counts = {(start, stop): count for start, stop, count in spans}
+            cache.save_spans(self.settings.alignment_file, s_name, counts)
 
-                                ss = [r.blocks[0][0], r.blocks[-1][1] - 1]
+        return ((span[0], span[1], count) for span, count in sorted(counts.items()))
 
-            if ss[0] is not None:
-                yield MaskedRegion((s_name, max(0, ss[0] - i_dist_l - 1), max(0, ss[1] + i_dist_r + 1)), self.settings)
+    def masked_region(self, region, spans):
+        """
+        Wraps a discovered region into a MaskedRegion. In single-pass
+        mode the read spans collected during region discovery are handed
+        over, so the region does not have to fetch its reads from the
+        alignment a second time. Otherwise the region reads from the
+        shared handle in self.pool.
+        """
+        if not self.settings.single_pass:
+            spans = None
+
+        return MaskedRegion(region, self.settings, spans, self.pool)
 
     def __iter__(self):
         for region in self.regions():
             yield region
 
+    def predict(self):
+        """
+        Yields (region, fragments) for all regions, with the references
+        in the order of the alignment header. With --threads N > 1 the
+        fragments are predicted by a pool of N worker processes that
+        each open their own alignment handle, while the regions are
+        discovered and the results are collected in the same order as a
+        serial run.
+        """
+        return self.in_reference_order(self.predict_regions())
+
+    def predict_regions(self):
+        """
+        Yields (region, fragments) in the order of self.regions().
+        """
+        if self.settings.threads > 1:
+            settings = copy.copy(self.settings)
+            settings.fasta_handle = None  # pysam handles can not be pickled; the workers do not need it
+
+            window = collections.deque()
+            with multiprocessing.Pool(self.settings.threads, init_worker, (settings,)) as pool:
+                for region in self.regions():
+                    window.append((region, pool.apply_async(predict_region, (region.region, region.spans))))
+                    region.spans = None
+
+                    if len(window) >= 16 * self.settings.threads:
+                        region, result = window.popleft()
+                        fragments, region.profile = result.get()
+                        yield region, fragments
+
+                while len(window) > 0:
+                    region, result = window.popleft()
+                    fragments, region.profile = result.get()
+                    yield region, fragments
+        else:
+            for region in self.regions():
+                yield region, region.predict_fragments()
+
+    def in_reference_order(self, predictions):
+        """
+        Yields the (region, fragments) of predictions, of which the
+        references come in the order of work_references(), in the order
+        of the alignment header. The regions of a reference come
+        together and in order, so the predictions of a reference are
+        passed on directly if it is next, and kept until then otherwise.
+
+        Once a reference comes in, all references before it in the work
+        order are complete. That includes references with reads of
+        which none gave a region (e.g. only insertions), so they are
+        not waited for.
+        """
+        rank = {s_name: i for i, s_name in enumerate(self.references())}
+        work = self.work_references()
+        position = {s_name: i for i, s_name in enumerate(work)}
+        pending = collections.deque(sorted(work, key=lambda s_name: rank.get(s_name, len(rank))))
+        buffered = {}
+
+        for region, fragments in predictions:
+            s_name = region.region[0]
+            current = position.get(s_name, len(position))
+
+            while len(pending) > 0 and pending[0] != s_name and position[pending[0]] < current:
+                for item in buffered.pop(pending.popleft(), []):
+                    yield item
+
+            if len(pending) > 0 and pending[0] == s_name:
+                yield region, fragments
+            else:
+                buffered.setdefault(s_name, []).append((region, list(fragments)))
+
+        for s_name in pending:
+            for item in buffered.pop(s_name, []):
+                yield item
+
+        for items in buffered.values():
+            for item in items:
+                yield item
+
+    def collect(self):
+        """
+        Predicts the fragments of all regions and returns them as
+        FragmentStore, which takes far less memory than keeping the
+        ncRNAFragment objects for post-processing.
+        """
+        store = FragmentStore()
+        for region, fragments in self.predict():
+            store.add_region(region.region, fragments)
+
+        self.pool.close()
+
+        return store
+
     def run(self):
         if(self.settings.format == 1):
-            fh = self.open_table()
+            writer = self.open_table()
         elif(self.settings.format == 2):
-            fh = self.open_gtf()
+            writer = self.open_gtf()
+        elif(self.settings.format == 'gtf.gz'):
+            writer = self.open_tabix_gtf()
+        elif(self.settings.format == 3):
+            writer = self.open_columnar()
+
+        if self.settings.profile_stages is not None:
+            profiler = StageProfiler(self.settings.profile_top)
+        else:
+            profiler = None
 
         logging.debug(" - Starting fragment detection")
 
-        k = 0
-        previous_seq = ''
-        for region in self:
-            if region.region[0] != previous_seq:
-                i = 0
-            previous_seq = region.region[0]
+        for region, fragments in self.predict():
+            writer.write(region.region, fragments)
 
-            for fragment in region:
-                i += 1
-                fragment_uid = 'FM_' + region.region[0] + '_' + str(i).zfill(12)
+            if profiler is not None:
+                profiler.add(region.profile)
 
-                if(self.settings.format == 1):
-                    fh.write(fragment.to_table_entry(fragment_uid, region, self.settings.fasta_handle))
-                elif(self.settings.format == 2):
-                    fh.write(fragment.to_gtf_entry(fragment_uid, region, self.settings.offset5p, self.settings.offset3p))
+        writer.close()
+        self.pool.close()
 
-            k += i
+        logging.info(' - Detected %i fragments' % writer.fragments)
+        logging.info(' - Opened the alignment file %i time(s)' % self.pool.opens)
 
-        fh.close()
-        logging.info(' - Detected %i fragments' % k)
+        if profiler is not None:
+            profiler.write(self.settings.profile_stages)
 
     def open_gtf(self):
         logging.info(" - Exporting results to: " + self.settings.output + " (GTF)")
 
-        if(self.settings.output == "-"):
-            fh = sys.stdout
-        else:
-            fh = open(self.settings.output, 'w')
-
-        return fh
+        return GTFWriter(self.settings.output, self.settings.offset5p, self.settings.offset3p)
 
     def open_table(self):
         logging.info(" - Exporting results to: " + self.settings.output + " (tab-delimited, per fragment)")
 
-        if(self.settings.output == "-"):
-            fh = sys.stdout
-        else:
-            fh = open(self.settings.output, 'w')
+        return TableWriter(self.settings.output, self.settings.fasta_handle, self.settings.fasta_cache)
 
-        if(self.settings.fasta_handle):
-            fh.write("Fragment\tSize\tReference sequence\tStart\tEnd\tPrecursor\tStart in precursor\tEnd in precursor\tSequence (no fasta file given)\tCorresponding-reads (start)\tCorresponding-reads (end)\tCorresponding-reads (total)\n")
-        else:
-            fh.write("Fragment\tSize\tReference sequence\tStart\tEnd\tPrecursor\tStart in precursor\tEnd in precursor\tSequence\tCorresponding-reads (start)\tCorresponding-reads (end)\tCorresponding-reads (total)\n")
+    def open_tabix_gtf(self):
+        logging.info(" - Exporting results to: " + self.settings.output + " (GTF, BGZF-compressed with tabix index)")
+
+        return TabixGTFWriter(self.settings.output, self.settings.offset5p, self.settings.offset3p)
+
+    def open_columnar(self):
+        logging.info(" - Exporting results to: " + self.settings.output + " (NumPy .npz columns, per fragment)")
 
-        return fh
+        return ColumnarWriter(self.settings.output, self.settings.fasta_handle, self.settings.fasta_cache)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import numpy
+
+from flaimapper.ncRNAFragment import ncRNAFragment
+from flaimapper.ncRNAFragment import fragment_uid
+
+
+class FragmentStore:
+    """Keeps predicted fragments as rows of one structured NumPy array
+    instead of as ncRNAFragment objects, for runs that keep all
+    fragments in memory for post-processing. The regions are stored
+    once, as (reference, start, end) tuples, and referred to by index.
+
+    Indexing the store returns an ncRNAFragment, so the per-object API
+    (to_gtf_entry, to_table_entry, ...) remains available.
+    """
+    dtype = numpy.dtype([('start', numpy.int64),
+                         ('stop', numpy.int64),
+                         ('supporting_reads_start', numpy.int64),
+                         ('supporting_reads_stop', numpy.int64),
+                         ('region', numpy.int64)])
+
+    def __init__(self, capacity=1024):
+        self.data = numpy.zeros(capacity, dtype=self.dtype)
+        self.size = 0
+        self.regions = []
+
+    def __len__(self):
+        return self.size
+
+    def add_region(self, region, fragments):
+        """
+        Adds the fragments predicted for region, a tuple of (reference,
+        start, end), and returns the index of the region.
+        """
+        region_id = len(self.regions)
+        self.regions.append(tuple(region[0:3]))
+
+        for fragment in fragments:
+            if self.size == len(self.data):
+                self.data = numpy.resize(self.data, max(1, 2 * len(self.data)))
+
+            self.data[self.size] = (fragment.start, fragment.stop, fragment.supporting_reads_start, fragment.supporting_reads_stop, region_id)
+            self.size += 1
+
+        return region_id
+
+    def records(self):
+        return self.data[:self.size]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.size
+        if i < 0 or i >= self.size:
+            raise IndexError("fragment index out of range")
+
+        record = self.data[i]
+        return ncRNAFragment(int(record['start']), int(record['stop']), int(record['supporting_reads_start']), int(record['supporting_reads_stop']))
+
+    def __iter__(self):
+        """
+        Yields (region, fragment) for all fragments, in the order they
+        were added.
+        """
+        for i in range(self.size):
+            yield self.regions[int(self.data[i]['region'])], self[i]
+
+    def rows(self):
+        """
+        Yields (uid, region, start, stop, supporting_reads_start,
+        supporting_reads_stop) of all fragments, with the uids numbered
+        per reference as in FlaiMapper.run.
+        """
+        previous_seq = ''
+        i = 0
+        for start, stop, reads_start, reads_stop, region_id in self.records().tolist():
+            region = self.regions[region_id]
+            if region[0] != previous_seq:
+                i = 0
+            previous_seq = region[0]
+
+            i += 1
+            yield fragment_uid(region[0], i), region, start, stop, reads_start, reads_stop
+
+    def write(self, writer):
+        """
+        Writes all fragments, region by region, with a FragmentWriter
+        (e.g. GTFWriter or TableWriter), which formats and numbers them
+        as FlaiMapper.run does. The writer is not closed.
+        """
+        bounds = numpy.searchsorted(self.records()['region'], numpy.arange(len(self.regions) + 1)).tolist()
+
+        for region_id, region in enumerate(self.regions):
+            writer.write(region, [self[i] for i in range(bounds[region_id], bounds[region_id + 1])])
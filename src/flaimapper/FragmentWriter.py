@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import abc
+import sys
+import gzip
+import mmap
+import struct
+import zipfile
+import collections
+
+import numpy
+import pysam
+
+from flaimapper.FragmentStore import FragmentStore
+from flaimapper.ncRNAFragment import fragment_uid
+from flaimapper.ncRNAFragment import gtf_entry
+from flaimapper.ncRNAFragment import table_entry
+
+
+def open_output(filename):
+    """
+    Opens filename for writing and returns (handle, binary): '-' is
+    stdout, '*.gz' is written gzip-compressed and '*.bgz' as BGZF
+    (blocked gzip, as used by samtools and tabix). The compressed
+    handles take bytes instead of str.
+    """
+    if filename == "-":
+        return sys.stdout, False
+    elif filename.endswith('.bgz'):
+        return pysam.BGZFile(filename, 'wb'), True
+    elif filename.endswith('.gz'):
+        return gzip.open(filename, 'wb'), True
+    else:
+        return open(filename, 'w'), False
+
+
+class RegionSequences:
+    """Fetches the reference sequence of a whole region from the FASTA
+    file once, so that the sequences of its fragments are slices of it
+    instead of separate lookups. The sequences of the last cache_size
+    regions are kept (least recently used are dropped), which helps when
+    regions overlap, e.g. in re-analysed shards.
+    """
+    def __init__(self, fasta_file, cache_size=1):
+        self.fasta_file = fasta_file
+        self.cache_size = max(1, cache_size)
+        self.cache = collections.OrderedDict()
+
+    def region(self, region):
+        key = (region[0], region[1], region[2])
+
+        if key in self.cache:
+            self.cache.move_to_end(key)
+        else:
+            self.cache[key] = self.fasta_file.fetch(region[0], region[1], region[2] + 1)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return self.cache[key]
+
+    def fetch(self, region, start, stop):
+        """
+        Returns the sequence of [start, stop] (0-based, relative to the
+        region), as fasta_file.fetch(region[0], region[1] + start,
+        region[1] + stop + 1) would.
+        """
+        return self.region(region)[start:stop + 1]
+
+
+class FragmentWriter(abc.ABC):
+    """Writes the predicted fragments per region: the entries of all
+    fragments of a region are formatted in one batch and collected in a
+    buffer that is written once it exceeds buffer_size characters.
+    Subclasses implement format_fragment.
+
+    The fragments are numbered per reference (FM_<reference>_<i>), so
+    the regions must be written in the order of FlaiMapper.regions().
+    Standard output is flushed but never closed.
+    """
+    buffer_size = 1 << 20
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fh, self.binary = self.open(filename)
+
+        self.buffer = []
+        self.buffered = 0
+
+        self.previous_seq = ''
+        self.i = 0
+        self.fragments = 0
+
+        self.write_header()
+
+    def open(self, filename):
+        return open_output(filename)
+
+    def write_header(self):
+        pass
+
+    @abc.abstractmethod
+    def format_fragment(self, uid, region, fragment):
+        """
+        Returns the entry of one fragment of region as string.
+        """
+
+    def format_region(self, region, fragments, i):
+        """
+        Returns the entries of the fragments of region as one string,
+        and the number of fragments. Their uids are numbered from i + 1.
+        """
+        entries = []
+        for fragment in fragments:
+            i += 1
+            entries.append(self.format_fragment(fragment_uid(region[0], i), region, fragment))
+
+        return ''.join(entries), len(entries)
+
+    def write(self, region, fragments):
+        """
+        Writes the fragments of region, a tuple of (reference, start,
+        end), and returns their number.
+        """
+        if region[0] != self.previous_seq:
+            self.i = 0
+        self.previous_seq = region[0]
+
+        chunk, n = self.format_region(region, fragments, self.i)
+        self.i += n
+        self.fragments += n
+
+        self.append(chunk)
+
+        return n
+
+    def append(self, chunk):
+        self.buffer.append(chunk)
+        self.buffered += len(chunk)
+
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        chunk = ''.join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+
+        if self.binary:
+            self.fh.write(chunk.encode('utf-8'))
+        else:
+            self.fh.write(chunk)
+
+    def close(self):
+        self.flush()
+
+        if self.fh is sys.stdout:
+            self.fh.flush()
+        else:
+            self.fh.close()
+
+
+class GTFWriter(FragmentWriter):
+    def __init__(self, filename, type_exon_offset5p, type_exon_offset3p):
+        self.type_exon_offset5p = type_exon_offset5p
+        self.type_exon_offset3p = type_exon_offset3p
+
+        FragmentWriter.__init__(self, filename)
+
+    def format_fragment(self, uid, region, fragment):
+        return gtf_entry(uid, region, fragment.start, fragment.stop, fragment.supporting_reads_start, fragment.supporting_reads_stop, self.type_exon_offset5p, self.type_exon_offset3p)
+
+
+class TabixGTFWriter(GTFWriter):
+    """Writes the GTF entries sorted by coordinate, as BGZF, and creates
+    a tabix index (<filename>.tbi) when closed, so that the fragments of
+    a locus can be looked up directly.
+
+    The regions of a reference arrive in order, but the fragments within
+    a region and the offsets of the exon lines are not, so the entries
+    of one reference are kept until the next reference starts and are
+    then sorted by their start position.
+    """
+    def __init__(self, filename, type_exon_offset5p, type_exon_offset3p):
+        self.reference_chunks = []
+
+        GTFWriter.__init__(self, filename, type_exon_offset5p, type_exon_offset3p)
+
+    def open(self, filename):
+        return pysam.BGZFile(filename, 'wb'), True
+
+    def write(self, region, fragments):
+        if region[0] != self.previous_seq:
+            self.flush_reference()
+
+        return GTFWriter.write(self, region, fragments)
+
+    def append(self, chunk):
+        self.reference_chunks.append(chunk)
+
+    def flush_reference(self):
+        lines = ''.join(self.reference_chunks).splitlines(True)
+        self.reference_chunks = []
+
+        lines.sort(key=lambda line: int(line.split('\t', 4)[3]))
+        for line in lines:
+            FragmentWriter.append(self, line)
+
+    def close(self):
+        self.flush_reference()
+        GTFWriter.close(self)
+
+        pysam.tabix_index(self.filename, preset='gff', force=True)
+
+
+class TableWriter(FragmentWriter):
+    def __init__(self, filename, fasta_file, fasta_cache_size=1):
+        self.fasta_file = fasta_file
+        self.sequences = RegionSequences(fasta_file, fasta_cache_size) if fasta_file else None
+
+        FragmentWriter.__init__(self, filename)
+
+    def write_header(self):
+        if(self.fasta_file):
+            self.append("Fragment\tSize\tReference sequence\tStart\tEnd\tPrecursor\tStart in precursor\tEnd in precursor\tSequence (no fasta file given)\tCorresponding-reads (start)\tCorresponding-reads (end)\tCorresponding-reads (total)\n")
+        else:
+            self.append("Fragment\tSize\tReference sequence\tStart\tEnd\tPrecursor\tStart in precursor\tEnd in precursor\tSequence\tCorresponding-reads (start)\tCorresponding-reads (end)\tCorresponding-reads (total)\n")
+
+    def format_fragment(self, uid, region, fragment):
+        sequence = self.sequences.fetch(region, fragment.start, fragment.stop) if self.sequences else ''
+
+        return table_entry(uid, region, fragment.start, fragment.stop, fragment.supporting_reads_start, fragment.supporting_reads_stop, sequence)
+
+
+class ColumnarWriter:
+    """Writes the fragments as typed columns into an uncompressed NumPy
+    .npz file (-f 3), which can be loaded memory-mapped with
+    load_columns, or with numpy.load. The columns correspond to the
+    tabular output:
+
+    uid (bytes), size, reference (index into reference_names), start,
+    end, start_in_precursor, end_in_precursor, sequence (bytes; empty
+    without --fasta), reads_start, reads_end and reads_total.
+
+    The precursor of a fragment is its reference sequence. All fragments
+    are kept in a FragmentStore until the writer is closed, so unlike
+    the FragmentWriter classes nothing is formatted per fragment.
+    """
+    def __init__(self, filename, fasta_file, fasta_cache_size=1):
+        self.filename = filename
+        self.fh = open(filename, 'wb')
+
+        self.sequences = RegionSequences(fasta_file, fasta_cache_size) if fasta_file else None
+        self.store = FragmentStore()
+        self.fragments = 0
+
+    def write(self, region, fragments):
+        n = len(self.store)
+        self.store.add_region(region, fragments)
+        n = len(self.store) - n
+
+        self.fragments += n
+
+        return n
+
+    def columns(self):
+        records = self.store.records()
+        regions = self.store.regions
+
+        reference_names = []
+        reference_ids = {}
+        region_reference = numpy.zeros(len(regions), dtype=numpy.int32)
+        region_start = numpy.zeros(len(regions), dtype=numpy.int64)
+        for i, region in enumerate(regions):
+            if region[0] not in reference_ids:
+                reference_ids[region[0]] = len(reference_names)
+                reference_names.append(region[0])
+
+            region_reference[i] = reference_ids[region[0]]
+            region_start[i] = region[1]
+
+        uids = []
+        sequences = []
+        for uid, region, start, stop, reads_start, reads_stop in self.store.rows():
+            uids.append(uid)
+            sequences.append(self.sequences.fetch(region, start, stop) if self.sequences else '')
+
+        offsets = region_start[records['region']]
+
+        return {'uid': numpy.array(uids, dtype=numpy.bytes_),
+                'size': records['stop'] - records['start'] + 1,
+                'reference': region_reference[records['region']],
+                'reference_names': numpy.array(reference_names, dtype=numpy.str_),
+                'start': offsets + records['start'],
+                'end': offsets + records['stop'],
+                'start_in_precursor': records['start'].copy(),
+                'end_in_precursor': records['stop'].copy(),
+                'sequence': numpy.array(sequences, dtype=numpy.bytes_),
+                'reads_start': records['supporting_reads_start'].copy(),
+                'reads_end': records['supporting_reads_stop'].copy(),
+                'reads_total': records['supporting_reads_start'] + records['supporting_reads_stop']}
+
+    def close(self):
+        numpy.savez(self.fh, **self.columns())
+        self.fh.close()
+
+
+def load_columns(filename):
+    """
+    Loads the columns written by ColumnarWriter as a dict of arrays that
+    are memory-mapped from filename instead of read into memory. This
+    relies on the members of the .npz file being stored uncompressed.
+    """
+    columns = {}
+
+    with open(filename, 'rb') as fh:
+        buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        with zipfile.ZipFile(fh) as archive:
+            members = archive.infolist()
+
+        for member in members:
+            if member.compress_type != zipfile.ZIP_STORED:
+                raise ValueError("Compressed member can not be memory-mapped: " + member.filename)
+
+            # Local file header: 30 bytes, followed by the name and extra field
+            fh.seek(member.header_offset)
+            name_length, extra_length = struct.unpack('<HH', fh.read(30)[26:30])
+            fh.seek(member.header_offset + 30 + name_length + extra_length)
+
+            version = numpy.lib.format.read_magic(fh)
+            if version == (1, 0):
+                shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(fh)
+            else:
+                shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(fh)
+
+            columns[member.filename[:-4]] = numpy.ndarray(shape, dtype=dtype, buffer=buf, offset=fh.tell(), order='F' if fortran_order else 'C')
+
+    return columns
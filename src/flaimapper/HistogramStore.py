@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+
+import numpy
+
+import flaimapper
+
+
+logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
+
+
+class HistogramStore:
+    """Read statistics of a region as used by step_01__parse_stats: the
+    number of reads starting and stopping at every position and, per
+    position, the number of reads of every length, accumulated from one
+    or more chunks of reads.
+
+    Without a budget the statistics are sparse: only the positions and
+    lengths that have reads are stored. With a budget (in bytes,
+    --memory-budget) the reads are expected in chunks of chunk_size
+    reads and counted in dense per-position arrays and (position x
+    length) matrices; arrays that do not fit in the remaining budget
+    are memory-mapped files in a temporary directory (--spill-dir),
+    which are removed by close().
+    """
+    def __init__(self, n, budget=None, directory=None):
+        self.n = n
+        self.budget = budget
+        self.directory = directory
+        self.tmp_dir = None
+        self.used = 0
+
+        self.min_length = 0
+        self.width = 0
+
+        if budget is None:
+            self.chunk_size = None
+            self.chunks = []
+        else:
+            # A quarter of the budget is left for the chunks of reads
+            self.chunk_size = max(1, budget // 4 // 128)
+
+            self.start_positions = self.allocate((n, ))
+            self.stop_positions = self.allocate((n, ))
+            self.start_lengths = None
+            self.stop_lengths = None
+
+    def allocate(self, shape):
+        size = 1
+        for dim in shape:
+            size *= dim
+        nbytes = size * numpy.dtype(numpy.int64).itemsize
+
+        if self.used + nbytes <= self.budget - self.budget // 4:
+            self.used += nbytes
+            return numpy.zeros(shape, dtype=numpy.int64)
+
+        if self.tmp_dir is None:
+            self.tmp_dir = tempfile.mkdtemp(prefix='flaimapper-', dir=self.directory)
+            logging.debug(" - Spilling read statistics to: " + self.tmp_dir)
+
+        # New files are zero-filled
+        fd, filename = tempfile.mkstemp(suffix='.dat', dir=self.tmp_dir)
+        os.close(fd)
+        return numpy.memmap(filename, dtype=numpy.int64, mode='w+', shape=shape)
+
+    def release(self, array):
+        if isinstance(array, numpy.memmap):
+            # The mapping itself is freed with the last reference to the array
+            os.remove(array.filename)
+        elif array is not None:
+            self.used -= array.nbytes
+
+    def widen(self, min_length, max_length):
+        """
+        Makes sure the length matrices have a column for every length
+        from min_length to max_length.
+        """
+        if self.width > 0:
+            min_length = min(min_length, self.min_length)
+            max_length = max(max_length, self.min_length + self.width - 1)
+            if min_length == self.min_length and max_length - min_length + 1 == self.width:
+                return
+
+        width = max_length - min_length + 1
+        offset = self.min_length - min_length
+
+        for name in ['start_lengths', 'stop_lengths']:
+            old = getattr(self, name)
+            new = self.allocate((self.n, width))
+            if old is not None:
+                new[:, offset:offset + self.width] = old
+            self.release(old)
+            setattr(self, name, new)
+
+        self.min_length = min_length
+        self.width = width
+
+    def accumulate(self, target, index, counts):
+        # Only the touched cells, so that no dense temporary array of the size of target is made
+        index, inverse = numpy.unique(index, return_inverse=True)
+        target.reshape(-1)[index] += numpy.bincount(inverse, weights=counts).astype(numpy.int64)
+
+    def add(self, pos_start, pos_stop, lengths, counts):
+        """
+        Adds reads, given as arrays of their start and stop position
+        (relative to the region), length (stop - start) and count.
+        """
+        if len(lengths) == 0:
+            return
+
+        if self.budget is None:
+            self.chunks.append((pos_start, pos_stop, lengths, counts))
+            return
+
+        self.widen(int(lengths.min()), int(lengths.max()))
+
+        self.accumulate(self.start_positions, pos_start, counts)
+        self.accumulate(self.stop_positions, pos_stop, counts)
+        self.accumulate(self.start_lengths, pos_start * self.width + (lengths - self.min_length), counts)
+        self.accumulate(self.stop_lengths, pos_stop * self.width + (lengths - self.min_length), counts)
+
+    def group(self, positions, lengths, counts):
+        """
+        Sums the counts per (position, length) and returns the sorted
+        positions, lengths and counts of the distinct pairs together
+        with the boundaries of every position.
+        """
+        keys, inverse = numpy.unique(positions * self.width + (lengths - self.min_length), return_inverse=True)
+        counts = numpy.bincount(inverse, weights=counts).astype(numpy.int64)
+        positions = keys // self.width
+
+        bounds = numpy.flatnonzero(numpy.diff(positions)) + 1
+        firsts = numpy.concatenate(([0], bounds)).astype(numpy.int64) if len(keys) > 0 else numpy.zeros(0, dtype=numpy.int64)
+
+        return positions, keys % self.width + self.min_length, counts, firsts
+
+    def finish(self):
+        """
+        Completes the statistics after all reads have been added.
+        """
+        if self.budget is None:
+            if len(self.chunks) > 0:
+                pos_start, pos_stop, lengths, counts = [numpy.concatenate(arrays) for arrays in zip(*self.chunks)]
+            else:
+                pos_start, pos_stop, lengths, counts = [numpy.zeros(0, dtype=numpy.int64)] * 4
+            self.chunks = None
+
+            if len(lengths) > 0:
+                self.min_length = int(lengths.min())
+                self.width = int(lengths.max()) - self.min_length + 1
+            else:
+                self.width = 1
+
+            self.start_groups = self.group(pos_start, lengths, counts)
+            self.stop_groups = self.group(pos_stop, lengths, counts)
+        elif self.width == 0:
+            self.widen(0, 0)
+
+    def positions(self, stops=False):
+        """
+        Returns the number of reads starting (or stopping) per position,
+        as {position: count} of the positions that have reads.
+        """
+        if self.budget is None:
+            positions, lengths, counts, firsts = self.stop_groups if stops else self.start_groups
+            return dict(zip(positions[firsts].tolist(), numpy.add.reduceat(counts, firsts).tolist() if len(firsts) > 0 else []))
+
+        counts = self.stop_positions if stops else self.start_positions
+        positions = numpy.flatnonzero(counts)
+        return dict(zip(positions.tolist(), counts[positions].tolist()))
+
+    def lengths(self, stops=False):
+        """
+        Yields (position, keys, counts) for every position that has
+        reads, in ascending order, with the ascending read lengths as
+        keys and their number of reads. As seen from the stop position
+        the lengths are negative.
+        """
+        if self.budget is None:
+            positions, lengths, counts, firsts = self.stop_groups if stops else self.start_groups
+            lasts = numpy.append(firsts[1:], len(positions)).tolist()
+            positions = positions.tolist()
+            lengths = lengths.tolist()
+            counts = counts.tolist()
+
+            for first, last in zip(firsts.tolist(), lasts):
+                if stops:
+                    yield positions[first], [-length for length in reversed(lengths[first:last])], counts[first:last][::-1]
+                else:
+                    yield positions[first], lengths[first:last], counts[first:last]
+        else:
+            matrix = self.stop_lengths if stops else self.start_lengths
+            for position in numpy.flatnonzero(self.stop_positions if stops else self.start_positions).tolist():
+                indices = numpy.flatnonzero(matrix[position])
+                keys = (indices + self.min_length).tolist()
+                counts = matrix[position, indices].tolist()
+
+                if stops:
+                    yield position, [-key for key in reversed(keys)], counts[::-1]
+                else:
+                    yield position, keys, counts
+
+    def close(self):
+        for name in ['start_positions', 'stop_positions', 'start_lengths', 'stop_lengths', 'start_groups', 'stop_groups']:
+            setattr(self, name, None)
+
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir)
+            self.tmp_dir = None
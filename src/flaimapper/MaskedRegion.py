@@ -37,13 +37,20 @@
 """
 
 import flaimapper
+import bisect
 import operator
 import logging
+import itertools
+import time
+
+import numpy
 
 from flaimapper.BAMParser import BAMParser
+from flaimapper.HistogramStore import HistogramStore
 from flaimapper.ncRNAFragment import ncRNAFragment
 from flaimapper.utils import sort_frequency_dict
 from flaimapper.utils import py2_round
+from flaimapper.utils import weighted_median
 
 
 logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
@@ -53,13 +60,16 @@ class MaskedRegion:
     """A masked region is a region masked in the reference genome to
     indicate where ncRNAs are located.
     """
-    def __init__(self, region, settings):
+    def __init__(self, region, settings, spans=None, pool=None):
         logging.debug("Masked region: " + region[0] + ":" + str(region[1]) + "-" + str(region[2]))
 
         self.region = region
         self.settings = settings
+        self.spans = spans  # {(start, stop): count} if already collected during region discovery
+        self.pool = pool  # AlignmentFilePool providing a shared handle; if None the region opens its own
+        self.profile = None  # per-step timings and counts, only filled with --profile-stages
 
-    def get_median_of_map(self, value_map_ref):
+    def get_median_of_map(self, value_map_ref, offset=0):
         """
         input:
         {
@@ -115,37 +125,43 @@ class MaskedRegion:
       { 22:8
         26:8 }
         -> median([22,26]) == return (float(k1 + k2)) / 2
+
+        ******
+
+        Because the trick removes equally many values from both ends,
+        the outcome is always the middle value of the expanded list (or
+        the float average of the two middle values if they differ). It
+        is therefore calculated directly from the cumulative counts.
+
+        The input can also be a row of a length-count array, in which
+        element i holds the count of key (offset + i), or a tuple of
+        the sorted keys and their counts.
         """
 
-        value_map = value_map_ref.copy()  # shallow? copy seems to also work since integers are deep copied
-
-        keys = sorted(value_map.keys())
-        while len(keys) > 1:
-            key_l = keys[0]
-            key_t = keys[-1]
-
-            if value_map[key_l] < value_map[key_t]:
-                value_map[key_t] -= value_map[key_l]
-                del(value_map[key_l])
-                keys.remove(key_l)
-            elif value_map[key_t] < value_map[key_l]:
-                value_map[key_l] -= value_map[key_t]
-                del(value_map[key_t])
-                keys.remove(key_t)
-            elif value_map[key_t] == value_map[key_l]:
-                if len(keys) == 2:
-                    return (float(keys[0] + keys[1])) / 2
-                else:
-                    del(value_map[key_l], value_map[key_t])
-                    keys.remove(key_l)
-                    keys.remove(key_t)
-
-        if len(keys) > 0:
-            return keys[0]
+        keys, counts = self.get_keys_and_counts(value_map_ref, offset)
+
+        return weighted_median(keys, counts)
+
+    def get_keys_and_counts(self, value_map, offset=0):
+        """
+        Returns the sorted keys and corresponding counts of a dict, of
+        a row of a length-count array (element i = key offset + i) or of
+        a tuple of sorted keys and counts.
+        """
+        if isinstance(value_map, tuple):
+            keys = list(value_map[0])
+            counts = list(value_map[1])
+        elif isinstance(value_map, dict):
+            keys = sorted(value_map.keys())
+            counts = [value_map[key] for key in keys]
         else:
-            return None
+            indices = numpy.flatnonzero(value_map)
+            keys = (indices + offset).tolist()
+            counts = value_map[indices].tolist()
 
-    def get_medians_of_map(self, value_map, window=15):
+        return keys, counts
+
+    def get_medians_of_map(self, value_map, window=15, offset=0):
         """
         input:
         {
@@ -157,207 +173,377 @@ class MaskedRegion:
         }
 
         needs to return TWO medians: [median({-62: 5, -61: 63, -58: 7}), median({-28: 23, -27: 21})]
+
+        The frame with the most reads is taken first (ties: the frame
+        with most keys, then the lowest key), its keys are removed and
+        the search is repeated on the remaining keys. The read count of
+        every frame is obtained from a prefix sum over the sorted keys
+        and a sliding window, and only the median of the selected frame
+        is calculated.
+
+        As for get_median_of_map, the input can also be a row of a
+        length-count array.
         """
 
-        ordered_keys = sorted(value_map.keys())
+        ordered_keys, ordered_counts = self.get_keys_and_counts(value_map, offset)
         frame_medians = []
 
         while len(ordered_keys) > 0:
-            max_element = {'median': None, 'reads': -1, 'key': None, 'remove': []}
+            prefix_sums = [0] + list(itertools.accumulate(ordered_counts))
+
+            max_element = (-1, -1, 0, 0)  # (reads, number of keys, first index, last index + 1)
+            lower = 0
+            upper = 0
             for key in ordered_keys:
-                other_keys = [_ for _ in ordered_keys if (_ >= (key - window) and _ <= (key + window))]
-                subset = {_: value_map[_] for _ in other_keys}
-                valsum = sum(subset.values())
-                element = {'median': self.get_median_of_map(subset), 'reads': valsum, 'key': key, 'remove': other_keys}
+                while ordered_keys[lower] < key - window:
+                    lower += 1
+                while upper < len(ordered_keys) and ordered_keys[upper] <= key + window:
+                    upper += 1
 
-                # order: valsum, len, key itself just for persistance
-                if element['reads'] > max_element['reads']:
-                    max_element = element
-                elif element['reads'] == max_element['reads'] and len(element['remove']) > len(max_element['remove']):
-                    max_element = element
-                elif element['reads'] == max_element['reads'] and len(element['remove']) == len(max_element['remove']) and element['key'] < max_element['key']:
-                    max_element = element
+                reads = prefix_sums[upper] - prefix_sums[lower]
+                if reads > max_element[0] or (reads == max_element[0] and upper - lower > max_element[1]):
+                    max_element = (reads, upper - lower, lower, upper)
 
-            frame_medians.append(max_element['median'])
+            frame_medians.append(weighted_median(ordered_keys[max_element[2]:max_element[3]], ordered_counts[max_element[2]:max_element[3]]))
 
-            for val in max_element['remove']:
-                ordered_keys.remove(val)
+            del ordered_keys[max_element[2]:max_element[3]]
+            del ordered_counts[max_element[2]:max_element[3]]
 
         return frame_medians if len(frame_medians) > 0 else None
 
+    def read_spans(self):
+        """
+        Yields (start, stop, count) for the reads aligned to the region.
+        If the spans were collected during region discovery (single-pass
+        mode) the alignment is not read again.
+        """
+        if self.spans is not None:
+            for span, count in self.spans.items():
+                yield span[0], span[1], count
+        else:
+            if self.pool is not None:
+                alignment = self.pool.get(self.settings.alignment_file)
+            else:
+                alignment = self.settings.alignment_file
+
+            for read in BAMParser(self.region, alignment, self.settings.read_weight).parse_spans():
+                yield read
+
+    def get_positions(self, reads, n):
+        """
+        Converts rows of (start, stop, count) to the start and stop
+        positions relative to the region, the lengths and the counts of
+        the reads that are within the region. Rows with a count of 0
+        (e.g. a weight tag of 0) are left out.
+        """
+        pos_start = reads[:, 0] - self.region[1]
+        pos_stop = reads[:, 1] - self.region[1]
+
+        in_bound = (pos_start >= 0) & (pos_stop >= 0) & (pos_start < n) & (pos_stop < n)
+        for i in numpy.flatnonzero(~in_bound).tolist():
+            logging.error("Alignment out of bound: (%i,%i) %s:%i-%i" % (pos_start[i], pos_stop[i], self.region[0], self.region[1], self.region[2]))
+        in_bound &= reads[:, 2] > 0
+
+        pos_start = pos_start[in_bound]
+        pos_stop = pos_stop[in_bound]
+        lengths = pos_stop - pos_start  # length as seen from the start position; from the stop position it is -length
+
+        return pos_start, pos_stop, lengths, reads[in_bound, 2]
+
+    def count_reads(self, n):
+        """
+        Returns a HistogramStore with the read statistics of the region.
+        With --memory-budget the reads are counted in chunks and arrays
+        that exceed the budget are memory-mapped in --spill-dir.
+        """
+        spans = itertools.chain.from_iterable(self.read_spans())
+
+        if self.settings.memory_budget is None:
+            store = HistogramStore(n)
+
+            # All reads as rows of (start, stop, count)
+            reads = numpy.fromiter(spans, dtype=numpy.int64).reshape(-1, 3)
+            store.add(*self.get_positions(reads, n))
+        else:
+            store = HistogramStore(n, int(self.settings.memory_budget * 1024 * 1024), self.settings.spill_dir)
+
+            reads = numpy.fromiter(itertools.islice(spans, 3 * store.chunk_size), dtype=numpy.int64).reshape(-1, 3)
+            while len(reads) > 0:
+                store.add(*self.get_positions(reads, n))
+                reads = numpy.fromiter(itertools.islice(spans, 3 * store.chunk_size), dtype=numpy.int64).reshape(-1, 3)
+
+        store.finish()
+        return store
+
+    def step_01__parse_stats(self):
+        """
+        Returns the read statistics of the region, only for the
+        positions (relative to the region) that have reads:
+        {position: reads starting}, {position: reads stopping} and the
+        median lengths of the reads starting and stopping per position,
+        as {position: [median length, ...]}.
+        """
+        logging.debug("Acquiring statistics")
+        n = self.region[2] - self.region[1] + 1  # both zero based; 0-0=0 while that should be 1, so 0-0+1=1
+
+        # Start / stop counts and the length distributions per position
+        return self.step_01__median_lengths(self.count_reads(n))
+
+    def step_01__median_lengths(self, store):
+        """
+        Second part of step_01__parse_stats: returns the statistics of
+        the read counts in store (see count_reads) and closes it.
+        """
+        # Calc medians, only for the positions that have reads
+        self_start_avg_lengths = {}
+        self_stop_avg_lengths = {}
+
+        for i, keys, counts in store.lengths():
+            avgLenF = self.get_medians_of_map((keys, counts), 15)
+            self_start_avg_lengths[i] = [int(py2_round(_ + 1)) for _ in avgLenF]
+
+        # From the stop positions the lengths are negative
+        for i, keys, counts in store.lengths(stops=True):
+            avgLenR = self.get_medians_of_map((keys, counts), 15)
+            self_stop_avg_lengths[i] = [int(py2_round(_ - 0.5)) for _ in avgLenR]  # Why -0.5 -> because of rounding a negative number
+
+        stats = (store.positions(),
+                 store.positions(stops=True),
+                 self_start_avg_lengths,
+                 self_stop_avg_lengths)
+        store.close()
+
+        return stats
+
+    def step_02__find_peaks(self, plist, drop_cutoff=0.1):
+        """
+        plist: {position: count} of the positions that have reads.
+        Positions without reads count as 0; because the counts are
+        walked over in order, only the first position of a gap (and the
+        position after the last one) has to be visited.
+        """
+        # Define variables:
+        peaks = {}
+
+        previous = 0
+        highest = 0
+        highestPos = -1
+
+        steps = []
+        last = None
+        for pos in sorted(plist):
+            if last is not None and pos > last + 1:
+                steps.append((last + 1, 0))
+            steps.append((pos, plist[pos]))
+            last = pos
+        steps.append((0 if last is None else last + 1, 0))
+
+        # Walk over list of [start/stop]-position counts:
+        for pos, current in steps:
+            if current > previous:  # and (current > (noise_type_alpha_cutoff/100.0*max(plist)))):
+                if current > highest:
+                    highest = current
+                    highestPos = pos
+            elif current < previous:
+                # if (current < (drop_cutoff*highest)) and (highestPos != -1):
+                # if (current < (100.0*drop_cutoff*highest)) and (highestPos != -1):
+                # if (current < (10.0*highest)) and (highestPos != -1):
+                if (drop_cutoff * current < highest) and (highestPos != -1):
+                    peaks[highestPos] = highest
+                    # highestPos = -1
+                    highest = 0
+
+            previous = current
+
+        return peaks
+
+    def step_03__smooth_filter_peaks(self, plist):
+        """Smooth filtering
+        """
+
+        psorted = sorted(plist.items(), key=operator.itemgetter(1, 0), reverse=True)
+
+        # There is a small mistake in the algorithm,
+        # it should search not for ALL peaks
+        # but only for ALL peaks except itself; position i can not be a noise product of i itself
+
+        # Only the peaks at the offsets in the parameters matrix can be
+        # affected, so they are looked up by position rather than
+        # comparing every pair of peaks. The peaks are still processed
+        # from high to low, so removed peaks do not filter others.
+        index = {item[0]: i for i, item in enumerate(psorted)}
+        matrix = [(diff, perc / 100.0) for diff, perc in self.settings.parameters.matrix.items()]
+
+        for i in range(len(psorted)):
+            if(psorted[i] is not None):
+                item = psorted[i]
+                for diff, perc in matrix:
+                    j = index.get(item[0] + diff)
+                    if((j is not None) and (j != i) and (psorted[j] is not None)):
+                        if((perc * item[1]) > psorted[j][1]):
+                            psorted[j] = None
+
+        return {x[0]: x[1] for x in psorted if x is not None}
+
+    def step_04__assemble_fragments(self, pstart, pstop, pexpectedStart, pexpectedStop):
+        """Assemble by peak reconstruction / traceback
+        """
+        logging.debug("Assembling fragments")
+
+        # The candidate positions are sorted once and the positions within
+        # the padding are found by bisection; positions deleted from
+        # pstart / pstop are skipped.
+        left_padding = self.settings.parameters.left_padding
+        right_padding = self.settings.parameters.right_padding
+
+        if len(pstart) >= len(pstop):									# More start than stop positions
+            pstartKeys = sorted(pstart.keys())
+            pstopSorted = sort_frequency_dict(pstop)
+            for itema in pstopSorted:
+                pos = itema[0]
+                for diff in pexpectedStop[pos]:
+                    predictedPos = pos + diff + 1							# 149 - 50 = 99; 149- 50 + 1 = 100 (example of read aligned to 100,149 (size=50)
+
+                    highest_scoring_position = (0, -1, -1, -1, -1, 99999)
+
+                    lower = bisect.bisect_left(pstartKeys, predictedPos - left_padding)
+                    upper = bisect.bisect_right(pstartKeys, predictedPos + right_padding)
+                    for item in pstartKeys[lower:upper]:
+                        if item in pstart:
+                            distance = abs(predictedPos - item)
+                            penalty = 1.0 - (distance * 0.09)
+
+                            score = pstart[item] * penalty
+                            if (score > highest_scoring_position[0]) or (score == highest_scoring_position[0] and distance < highest_scoring_position[5]):
+                                highest_scoring_position = (score, item, pos, pstart[item], pstop[pos], distance)
+
+                    if highest_scoring_position[0] > 0.0:
+                        del(pstart[highest_scoring_position[1]])
+                        yield ncRNAFragment(highest_scoring_position[1], highest_scoring_position[2], highest_scoring_position[3], highest_scoring_position[4])
+        else:															# More stop than start positions
+            pstopKeys = sorted(pstop.keys())
+            pstartSorted = sort_frequency_dict(pstart)
+            for itema in pstartSorted:
+                pos = itema[0]
+                for diff in pexpectedStart[pos]:
+                    predictedPos = pos + diff  # @todo figure out if this requires << + 1
+
+                    highest_scoring_position = (0, -1, -1, -1, -1, 99999)
+
+                    lower = bisect.bisect_left(pstopKeys, predictedPos - left_padding)
+                    upper = bisect.bisect_right(pstopKeys, predictedPos + right_padding)
+                    for item in reversed(pstopKeys[lower:upper]):
+                        if item in pstop:
+                            distance = abs(predictedPos - item)
+                            penalty = 1.0 - (distance * 0.09)
+
+                            score = pstop[item] * penalty
+                            if (score > highest_scoring_position[0]) or (score == highest_scoring_position[0] and distance < highest_scoring_position[5]):
+                                highest_scoring_position = (score, pos, item, pstart[pos], pstop[item], distance)  # (Highest score -- a bug... should be 'score', Start, Stop, Reads on start, Reads on stop)
+
+                    if highest_scoring_position[0] > 0.0:
+                        del(pstop[highest_scoring_position[2]])
+                        yield ncRNAFragment(highest_scoring_position[1], highest_scoring_position[2], highest_scoring_position[3], highest_scoring_position[4])
+
     def predict_fragments(self):
-        def step_01__parse_stats():
-            logging.debug("Acquiring statistics")
-            n = self.region[2] - self.region[1] + 1  # both zero based; 0-0=0 while that should be 1, so 0-0+1=1
-
-            self_start_positions = [0] * n
-            self_stop_positions = [0] * n
-
-            tmp_start_avg_lengths = [{} for x in range(n)]  # [{}] * n makes references instead of copies
-            tmp_stop_avg_lengths = [{} for x in range(n)]  # [{}] * n makes references instead of copies
-
-            for read in BAMParser(self.region, self.settings.alignment_file):
-                pos_start = read[0] - self.region[1]
-                pos_stop = read[1] - self.region[1]
-
-                if pos_start >= 0 and pos_stop >= 0 and pos_start < n and pos_stop < n:
-                    len_start = read[1] - read[0]
-                    len_stop = read[0] - read[1]
-
-                    self_start_positions[read[0] - self.region[1]] += 1
-                    self_stop_positions[read[1] - self.region[1]] += 1
-
-                    if len_start not in tmp_start_avg_lengths[pos_start]:
-                        tmp_start_avg_lengths[pos_start][len_start] = 0
-
-                    if len_stop not in tmp_stop_avg_lengths[pos_stop]:
-                        tmp_stop_avg_lengths[pos_stop][len_stop] = 0
-
-                    tmp_start_avg_lengths[pos_start][len_start] += 1
-                    tmp_stop_avg_lengths[pos_stop][len_stop] += 1
-
-                else:
-                    logging.error("Alignment out of bound: (%i,%i) %s:%i-%i" % (pos_start, pos_stop, self.region[0], self.region[1], self.region[2]))
-
-            # Calc medians
-            self_start_avg_lengths = []
-            self_stop_avg_lengths = []
-
-            for i in range(len(tmp_stop_avg_lengths)):
-                # avgLenF = self.get_median_of_map(tmp_start_avg_lengths[i])
-                # avgLenR = self.get_median_of_map(tmp_stop_avg_lengths[i])
-
-                avgLenF = self.get_medians_of_map(tmp_start_avg_lengths[i], 15)
-                avgLenR = self.get_medians_of_map(tmp_stop_avg_lengths[i], 15)
-
-                if avgLenF is not None:
-                    avgLenF = [int(py2_round(_ + 1)) for _ in avgLenF]
-                if avgLenR is not None:
-                    avgLenR = [int(py2_round(_ - 0.5))for _ in avgLenR]							# Why -0.5 -> because of rounding a negative number
-
-                self_start_avg_lengths.append(avgLenF)
-                self_stop_avg_lengths.append(avgLenR)
-
-            return (self_start_positions,
-                    self_stop_positions,
-                    self_start_avg_lengths,
-                    self_stop_avg_lengths)
-
-        def step_02__find_peaks(plist, drop_cutoff=0.1):
-            # Define variables:
-            peaks = {}
-
-            previous = 0
-            highest = 0
-            highestPos = -1
-
-            # Walk over list of [start/stop]-position counts:
-            for pos in range(len(plist)):
-                current = plist[pos]
-                if current > previous:  # and (current > (noise_type_alpha_cutoff/100.0*max(plist)))):
-                    if current > highest:
-                        highest = current
-                        highestPos = pos
-                elif current < previous:
-                    # if (current < (drop_cutoff*highest)) and (highestPos != -1):
-                    # if (current < (100.0*drop_cutoff*highest)) and (highestPos != -1):
-                    # if (current < (10.0*highest)) and (highestPos != -1):
-                    if (drop_cutoff * current < highest) and (highestPos != -1):
-                        peaks[highestPos] = highest
-                        # highestPos = -1
-                        highest = 0
-
-                previous = current
-
-            return peaks
-
-        def step_03__smooth_filter_peaks(plist):
-            """Smooth filtering
-            """
-
-            psorted = sorted(plist.items(), key=operator.itemgetter(1, 0), reverse=True)
-
-            # There is a small mistake in the algorithm,
-            # it should search not for ALL peaks
-            # but only for ALL peaks except itself; position i can not be a noise product of i itself
-
-            n = range(len(psorted))
-
-            for i in n:
-                if(psorted[i] is not None):
-                    item = psorted[i]
-                    for j in n:							# Can be limited to size and -size of self.self.settings.parametersmatrix
-                        if((psorted[j] is not None) and (j != i)):
-                            item2 = psorted[j]
-                            diff = item2[0] - item[0]
-                            if diff in self.settings.parameters.matrix:
-                                perc = self.settings.parameters.matrix[diff] / 100.0
-                                if((perc * item[1]) > item2[1]):
-                                    psorted[j] = None
-
-            return {x[0]: x[1] for x in psorted if x is not None}
-
-        def step_04__assemble_fragments(pstart, pstop, pexpectedStart, pexpectedStop):
-            """Assemble by peak reconstruction / traceback
-            """
-            logging.debug("Assembling fragments")
-
-            if len(pstart) >= len(pstop):									# More start than stop positions
-                pstopSorted = sort_frequency_dict(pstop)
-                for itema in pstopSorted:
-                    pos = itema[0]
-                    for diff in pexpectedStop[pos]:
-                        predictedPos = pos + diff + 1							# 149 - 50 = 99; 149- 50 + 1 = 100 (example of read aligned to 100,149 (size=50)
-
-                        highest_scoring_position = (0, -1, -1, -1, -1, 99999)
-
-                        for item in sorted(pstart.keys()):
-                            if item >= predictedPos - self.settings.parameters.left_padding and item <= predictedPos + self.settings.parameters.right_padding:
-                                distance = abs(predictedPos - item)
-                                penalty = 1.0 - (distance * 0.09)
-
-                                score = pstart[item] * penalty
-                                if (score > highest_scoring_position[0]) or (score == highest_scoring_position[0] and distance < highest_scoring_position[5]):
-                                    highest_scoring_position = (score, item, pos, pstart[item], pstop[pos], distance)
-
-                        if highest_scoring_position[0] > 0.0:
-                            del(pstart[highest_scoring_position[1]])
-                            yield ncRNAFragment(highest_scoring_position[1], highest_scoring_position[2], highest_scoring_position[3], highest_scoring_position[4])
-            else:															# More stop than start positions
-                pstartSorted = sort_frequency_dict(pstart)
-                for itema in pstartSorted:
-                    pos = itema[0]
-                    for diff in pexpectedStart[pos]:
-                        predictedPos = pos + diff  # @todo figure out if this requires << + 1
-
-                        highest_scoring_position = (0, -1, -1, -1, -1, 99999)
-
-                        for item in sorted(pstop.keys(), reverse=True):
-                            if item >= predictedPos - self.settings.parameters.left_padding and item <= predictedPos + self.settings.parameters.right_padding:
-                                distance = abs(predictedPos - item)
-                                penalty = 1.0 - (distance * 0.09)
-
-                                score = pstop[item] * penalty
-                                if (score > highest_scoring_position[0]) or (score == highest_scoring_position[0] and distance < highest_scoring_position[5]):
-                                    highest_scoring_position = (score, pos, item, pstart[pos], pstop[item], distance)  # (Highest score -- a bug... should be 'score', Start, Stop, Reads on start, Reads on stop)
-
-                        if highest_scoring_position[0] > 0.0:
-                            del(pstop[highest_scoring_position[2]])
-                            yield ncRNAFragment(highest_scoring_position[1], highest_scoring_position[2], highest_scoring_position[3], highest_scoring_position[4])
+        """
+        With a region cache (--cache), the statistics of step 01 and the
+        peaks of steps 02 and 03 are taken from the cache if present, and
+        stored otherwise.
+        """
+        if self.settings.profile_stages is not None:
+            for fragment in self.predict_fragments_profiled():
+                yield fragment
+            return
+
+        cache = self.settings.region_cache
 
         # Acquire statistics
-        start_positions, stop_positions, start_avg_lengths, stop_avg_lengths = step_01__parse_stats()
+        stats = cache.load_stats(self.region) if cache is not None else None
+        if stats is None:
+            stats = self.step_01__parse_stats()
+            if cache is not None:
+                cache.save_stats(self.region, stats)
+        start_positions, stop_positions, start_avg_lengths, stop_avg_lengths = stats
+
+        peaks = cache.load_peaks(self.region) if cache is not None else None
+        if peaks is None:
+            # Finds peaks
+            start_positions = self.step_02__find_peaks(start_positions)
+            stop_positions = self.step_02__find_peaks(stop_positions)
+
+            # Correct / filter noisy peaks
+            start_positions = self.step_03__smooth_filter_peaks(start_positions)
+            stop_positions = self.step_03__smooth_filter_peaks(stop_positions)
+            if cache is not None:
+                cache.save_peaks(self.region, (start_positions, stop_positions))
+        else:
+            start_positions, stop_positions = peaks
 
-        # Finds peaks
-        start_positions = step_02__find_peaks(start_positions + [0])
-        stop_positions = step_02__find_peaks(stop_positions + [0])
+        # Trace start and stop positions together and obtain actual peaks
+        for fragment in self.step_04__assemble_fragments(start_positions, stop_positions, start_avg_lengths, stop_avg_lengths):
+            yield fragment
 
-        # Correct / filter noisy peaks
-        start_positions = step_03__smooth_filter_peaks(start_positions)
-        stop_positions = step_03__smooth_filter_peaks(stop_positions)
+    def predict_fragments_profiled(self):
+        """
+        Same as predict_fragments, but records the wall time of every
+        step and the number of reads, peaks and fragments in
+        self.profile (--profile-stages). Step 01 is timed in two parts:
+        reading the alignments (step_01_reads) and the median read
+        lengths (step_01_medians).
+
+        The time of loading the statistics and the peaks from the region
+        cache is recorded as that of step_01_reads and step 03.
+        """
+        profile = {'region': self.region}
+        cache = self.settings.region_cache
+
+        t = time.perf_counter()
+        stats = cache.load_stats(self.region) if cache is not None else None
+        if stats is None:
+            store = self.count_reads(self.region[2] - self.region[1] + 1)
+            profile['step_01_reads'] = time.perf_counter() - t
+
+            t = time.perf_counter()
+            stats = self.step_01__median_lengths(store)
+            if cache is not None:
+                cache.save_stats(self.region, stats)
+            profile['step_01_medians'] = time.perf_counter() - t
+        else:
+            profile['step_01_reads'] = time.perf_counter() - t
+            profile['step_01_medians'] = 0.0
+        start_positions, stop_positions, start_avg_lengths, stop_avg_lengths = stats
+        profile['reads'] = sum(start_positions.values())
+
+        t = time.perf_counter()
+        peaks = cache.load_peaks(self.region) if cache is not None else None
+        if peaks is None:
+            start_positions = self.step_02__find_peaks(start_positions)
+            stop_positions = self.step_02__find_peaks(stop_positions)
+            profile['step_02'] = time.perf_counter() - t
+
+            t = time.perf_counter()
+            start_positions = self.step_03__smooth_filter_peaks(start_positions)
+            stop_positions = self.step_03__smooth_filter_peaks(stop_positions)
+            if cache is not None:
+                cache.save_peaks(self.region, (start_positions, stop_positions))
+            profile['step_03'] = time.perf_counter() - t
+        else:
+            start_positions, stop_positions = peaks
+            profile['step_02'] = 0.0
+            profile['step_03'] = time.perf_counter() - t
 
-        # Trace start and stop positions together and obtain actual peaks
-        for fragment in step_04__assemble_fragments(start_positions, stop_positions, start_avg_lengths, stop_avg_lengths):
+        profile['start_peaks'] = len(start_positions)
+        profile['stop_peaks'] = len(stop_positions)
+
+        t = time.perf_counter()
+        fragments = list(self.step_04__assemble_fragments(start_positions, stop_positions, start_avg_lengths, stop_avg_lengths))
+        profile['step_04'] = time.perf_counter() - t
+        profile['fragments'] = len(fragments)
+
+        self.profile = profile
+
+        for fragment in fragments:
             yield fragment
 
     def __iter__(self):
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import flaimapper
+import heapq
+import bisect
+import logging
+import operator
+import collections
+import multiprocessing
+
+import pysam
+
+from .BAMParser import AlignmentFilePool
+from .BAMParser import BAMParser
+from .BAMParser import index_read_counts
+from .FlaiMapper import FlaiMapper
+from .FlaiMapper import SpanClusters
+from .MaskedRegion import MaskedRegion
+from .ncRNAFragment import fragment_uid
+
+
+logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
+
+
+CHUNK_SIZE = 4096  # spans per message of a counting process
+
+
+def sample_spans(sample, filename, s_name, weight, cache, pool):
+    """
+    Yields (start, stop, count) for the distinct spans of the reads of
+    one sample on reference s_name, ordered by start, read with the
+    handle of the sample in pool. With a region cache they are taken from the cache
+    if present, and stored once all have been read otherwise.
+    """
+    spans = cache.load_spans(filename, s_name) if cache is not None else None
+    if spans is not None:
+        for span, count in sorted(spans.items()):
+            yield span[0], span[1], count
+        return
+
+    alignment_file = pool.get(filename, sample)
+    spans = {}
+
+    if s_name in alignment_file.references:
+        region = (s_name, 0, alignment_file.get_reference_length(s_name))
+        for start, stop, count in BAMParser(region, alignment_file, weight).parse_spans():
+            if cache is not None:
+                spans[(start, stop)] = count
+            yield start, stop, count
+
+    if cache is not None:
+        cache.save_spans(filename, s_name, spans)
+
+
+def tag_spans(spans, sample):
+    for start, stop, count in spans:
+        yield start, stop, count, sample
+
+
+def merge_samples(samples, s_name, weight, cache, pool):
+    """
+    Returns an iterator of (start, stop, count, sample) over the spans
+    of all samples, a list of (sample, filename), on reference s_name,
+    ordered by start. The samples are read side by side, so only the
+    spans at the current position are kept in memory.
+    """
+    streams = [tag_spans(sample_spans(sample, filename, s_name, weight, cache, pool), sample) for sample, filename in samples]
+
+    return heapq.merge(*streams, key=operator.itemgetter(0))
+
+
+def count_samples(samples, references, weight, cache, queue):
+    """
+    Counting process of MultiSampleFlaiMapper.count_references(): puts
+    the merge_samples() of its own samples per reference on queue, in
+    chunks of (spans, last), where last marks the end of the reference.
+    An exception is put on the queue instead.
+    """
+    pool = AlignmentFilePool()
+    try:
+        for s_name in references:
+            chunk = []
+            for span in merge_samples(samples, s_name, weight, cache, pool):
+                chunk.append(span)
+                if len(chunk) >= CHUNK_SIZE:
+                    queue.put((chunk, False))
+                    chunk = []
+
+            queue.put((chunk, True))
+    except Exception as err:
+        queue.put(err)
+    finally:
+        pool.close()
+
+
+def receive_spans(queue):
+    """
+    Yields the spans of one reference put on queue by count_samples().
+    """
+    while True:
+        message = queue.get()
+        if isinstance(message, Exception):
+            raise message
+
+        chunk, last = message
+        for span in chunk:
+            yield span
+
+        if last:
+            return
+
+
+def split_spans(spans, regions):
+    """
+    Yields (region, spans) for the regions of one reference (sorted by
+    start), with spans the list of the (start, stop, ...) of spans,
+    ordered by start, that belong to it: every span goes to the last
+    region starting at or before it, if it lies within.
+    """
+    starts = [region[1] for region in regions]
+    current = 0
+    group = []
+
+    for span in spans:
+        i = bisect.bisect_right(starts, span[0]) - 1
+        while current < i:
+            yield regions[current], group
+            current += 1
+            group = []
+
+        if i >= 0 and span[1] <= regions[i][2]:
+            group.append(span)
+
+    while current < len(regions):
+        yield regions[current], group
+        current += 1
+        group = []
+
+
+class MultiSampleFlaiMapper(FlaiMapper):
+    """Runs FlaiMapper on multiple alignments (samples) at once.
+
+    The regions are discovered over the union of the samples and the
+    fragments are predicted on the pooled reads, which gives the same
+    annotation as a single run on the merged alignments. The reads of
+    every sample supporting the fragments are written as matrix (one
+    row per fragment, one column per sample) to settings.support_matrix.
+
+    Every sample is read once: per reference, the spans of the reads of
+    all samples are merged by position, which gives the regions, the
+    pooled reads of the regions and the support per sample, while only
+    the spans of the current region are kept in memory. With --cache the
+    spans are kept per sample. With --threads the samples are read by
+    separate processes while the regions are predicted.
+    """
+    def check_alignment_index(self):
+        for filename in self.settings.alignment_files[1:]:
+            self.open_indexed(filename).close()
+
+        FlaiMapper.check_alignment_index(self)
+
+    def available_references(self):
+        """
+        The references of all samples, in the order of the first sample
+        followed by those only present in later samples.
+        """
+        references = []
+        seen = set()
+        for filename in self.settings.alignment_files:
+            with pysam.AlignmentFile(filename, 'rb') as alignment_file:
+                for s_name in alignment_file.references:
+                    if s_name not in seen:
+                        seen.add(s_name)
+                        references.append(s_name)
+
+        return references
+
+    def reference_read_counts(self):
+        """
+        The number of mapped reads per reference over all samples, or
+        None if the index of any sample has no statistics.
+        """
+        counts = {}
+        for filename in self.settings.alignment_files:
+            with pysam.AlignmentFile(filename, 'rb') as alignment_file:
+                sample_counts = index_read_counts(alignment_file)
+
+            if sample_counts is None:
+                return None
+
+            for s_name, count in sample_counts.items():
+                counts[s_name] = counts.get(s_name, 0) + count
+
+        return counts
+
+    def count_references(self, references):
+        """
+        Yields (reference, spans) for the references, in their order,
+        with spans the merge_samples() of all samples. The spans must be
+        consumed before the next reference is taken.
+
+        With --threads N > 1 the samples are spread over N processes (at
+        most one per sample), that each read their own samples only and
+        send their merged spans in chunks; at most 16 chunks per process
+        are waiting to be taken.
+        """
+        samples = list(enumerate(self.settings.alignment_files))
+        weight = self.settings.read_weight
+        cache = self.settings.region_cache
+
+        if self.settings.threads > 1:
+            n = min(self.settings.threads, len(samples))
+            queues = [multiprocessing.Queue(16) for i in range(n)]
+            workers = [multiprocessing.Process(target=count_samples, args=(samples[i::n], references, weight, cache, queues[i]), daemon=True) for i in range(n)]
+            for worker in workers:
+                worker.start()
+
+            try:
+                for s_name in references:
+                    yield s_name, heapq.merge(*[receive_spans(queue) for queue in queues], key=operator.itemgetter(0))
+            finally:
+                for worker in workers:
+                    worker.terminate()
+                    worker.join()
+        else:
+            for s_name in references:
+                yield s_name, merge_samples(samples, s_name, weight, cache, self.pool)
+
+    def regions(self):
+        """
+        Yields the regions as MaskedRegion with the pooled reads of all
+        samples, and keeps the support of every sample per region in
+        self.sample_support until it is predicted. With --region-index
+        the regions are taken from the index if it is up to date, and
+        otherwise written to it.
+        """
+        self.sample_support = {}
+
+        index = self.region_index()
+        indexed = index.load() if index is not None else None
+        if indexed is not None:
+            reference_regions = collections.defaultdict(list)
+            for region in indexed:
+                reference_regions[region[0]].append(region)
+        else:
+            discovered = []
+
+        logging.debug(" - Counting the reads of %i samples" % len(self.settings.alignment_files))
+        for s_name, spans in self.count_references(self.work_references()):
+            if indexed is not None:
+                groups = split_spans(spans, sorted(reference_regions[s_name], key=lambda region: region[1]))
+            else:
+                groups = self.discover_reference(s_name, spans)
+
+            for region, group in groups:
+                if indexed is None:
+                    discovered.append(region)
+
+                yield self.pooled_region(region, group)
+
+        if indexed is None and index is not None:
+            index.save(discovered)
+
+    def discover_reference(self, s_name, spans):
+        """
+        Yields (region, spans) for the regions of reference s_name,
+        discovered on the merged spans of the samples as
+        FlaiMapper.discover_regions would on the merged alignment.
+        """
+        clusters = SpanClusters(self.settings.parameters.left_padding, self.settings.parameters.right_padding)
+
+        for ss, group in clusters.groups(spans):
+            yield clusters.region(s_name, ss), group
+
+    def pooled_region(self, region, spans):
+        """
+        Returns the region as MaskedRegion with the pooled (start, stop,
+        count, sample) spans of the samples, and stores the number of
+        reads per start- and per stop-position (relative to the region
+        start) of every sample in self.sample_support.
+        """
+        pooled = {}
+        support = [(collections.Counter(), collections.Counter()) for filename in self.settings.alignment_files]
+
+        for start, stop, count, sample in spans:
+            pooled[(start, stop)] = pooled.get((start, stop), 0) + count
+
+            starts, stops = support[sample]
+            starts[start - region[1]] += count
+            stops[stop - region[1]] += count
+
+        self.sample_support[region] = support
+
+        return MaskedRegion(region, self.settings, pooled, self.pool)
+
+    def predict(self):
+        """
+        As FlaiMapper.predict, but keeps per fragment the reads of every
+        sample supporting its start and stop, for the support matrix.
+        """
+        self.supports = []
+
+        for region, fragments in FlaiMapper.predict(self):
+            fragments = list(fragments)
+            support = self.sample_support.pop(region.region)
+            self.supports.append((region.region[0], [[starts[fragment.start] + stops[fragment.stop] for starts, stops in support] for fragment in fragments]))
+
+            yield region, fragments
+
+    def run(self):
+        FlaiMapper.run(self)
+
+        self.write_support_matrix()
+
+    def write_support_matrix(self):
+        """
+        Writes per fragment (uids numbered as in the annotation) and per
+        sample the number of reads supporting its start and stop.
+        """
+        logging.info(" - Exporting the support per sample to: " + self.settings.support_matrix)
+
+        with open(self.settings.support_matrix, 'w') as fh:
+            fh.write("Fragment\t" + "\t".join(self.settings.alignment_files) + "\n")
+
+            previous_seq = ''
+            for s_name, rows in self.supports:
+                if s_name != previous_seq:
+                    i = 0
+                previous_seq = s_name
+
+                for row in rows:
+                    i += 1
+                    fh.write(fragment_uid(s_name, i) + "\t" + "\t".join(str(value) for value in row) + "\n")
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+
+import re
+import sys
+import gzip
+import logging
+
+import pysam
+
+from .ncRNAFragment import fragment_uid
+
+
+class OutputMerger:
+    """Merges the partial outputs of sharded runs (--region or
+    --contigs-from) into the output a single run would have produced:
+    the references are written in the order of the alignment header and
+    the fragment uids (FM_<reference>_<i>) are renumbered per reference.
+    """
+    regex_gene_id = re.compile('gene_id "([^"]*)"')
+
+    def __init__(self, alignment_file, output_format):
+        with pysam.AlignmentFile(alignment_file, 'rb') as fh:
+            self.references = list(fh.references)
+
+        self.format = output_format
+
+    def parse(self, filename):
+        """Yields (header, reference, uid, line) for every line in a
+        partial output, where header is True for the table header.
+        Outputs ending with '.gz' or '.bgz' are read decompressed.
+        """
+        if filename.endswith('.gz') or filename.endswith('.bgz'):
+            fh = gzip.open(filename, 'rt')
+        else:
+            fh = open(filename, 'r')
+
+        with fh:
+            for line in fh:
+                if len(line.strip()) > 0:
+                    params = line.rstrip('\n').split('\t')
+
+                    if self.format == 1:
+                        if params[0] == 'Fragment':
+                            yield True, None, None, line
+                        else:
+                            yield False, params[2], params[0], line
+                    else:
+                        yield False, params[0], self.regex_gene_id.search(params[8]).group(1), line
+
+    def merge(self, partial_outputs, output):
+        header = None
+        chunks = {}  # reference -> [(uid, line), ...]
+        sources = {}  # reference -> partial output it was found in
+
+        for filename in partial_outputs:
+            logging.debug("Reading partial output: " + filename)
+
+            for is_header, reference, uid, line in self.parse(filename):
+                if is_header:
+                    if header is None:
+                        header = line
+                    elif header != line:
+                        raise ValueError("Partial output has a different header: " + filename)
+                else:
+                    if reference not in sources:
+                        if reference not in self.references:
+                            raise ValueError("Reference sequence not present in alignment file: " + reference)
+
+                        sources[reference] = filename
+                        chunks[reference] = []
+                    elif sources[reference] != filename:
+                        raise ValueError("Reference sequence " + reference + " is present in multiple partial outputs: " + sources[reference] + ", " + filename)
+
+                    chunks[reference].append((uid, line))
+
+        if output == "-":
+            fh = sys.stdout
+        else:
+            fh = open(output, 'w')
+
+        if header is not None:
+            fh.write(header)
+
+        k = 0
+        for reference in self.references:
+            if reference in chunks:
+                i = 0
+                previous_uid = None
+                for uid, line in chunks[reference]:
+                    if uid != previous_uid:
+                        i += 1
+                    previous_uid = uid
+
+                    new_uid = fragment_uid(reference, i)
+                    if self.format == 1:
+                        fh.write(new_uid + line[len(uid):])
+                    else:
+                        fh.write(line.replace('gene_id "' + uid + '"', 'gene_id "' + new_uid + '"'))
+
+                k += i
+
+        if fh is sys.stdout:
+            fh.flush()
+        else:
+            fh.close()
+
+        logging.info(' - Merged %i fragments from %i partial outputs' % (k, len(partial_outputs)))
@@ -41,6 +41,8 @@ class Read:
     """
     Describes an aligned read as part of SSLM data
     """
+    __slots__ = ('start', 'stop', 'name', 'sequence')
+
     def __init__(self, start, stop, name, sequence):
         self.start = start
         self.stop = stop
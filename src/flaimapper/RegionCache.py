@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import os
+import pickle
+import hashlib
+import logging
+import tempfile
+
+import flaimapper
+
+
+def index_filename(alignment_file):
+    """
+    Returns the filename of the index of alignment_file, or None if it
+    has none.
+    """
+    for filename in [alignment_file + '.bai', alignment_file + '.csi', os.path.splitext(alignment_file)[0] + '.bai']:
+        if os.path.isfile(filename):
+            return filename
+
+    return None
+
+
+def alignment_identity(alignment_file):
+    """
+    Identifies the content of an alignment file by its size,
+    modification time and the checksum of its index.
+    """
+    stat = os.stat(alignment_file)
+    identity = [str(stat.st_size), str(stat.st_mtime_ns)]
+
+    index = index_filename(alignment_file)
+    if index is not None:
+        checksum = hashlib.sha1()
+        with open(index, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b''):
+                checksum.update(chunk)
+        identity.append(checksum.hexdigest())
+
+    return identity
+
+
+def parameters_identity(parameters):
+    """
+    Identifies the filter parameters (FilterParameters) by their matrix
+    and padding.
+    """
+    matrix = sorted(parameters.matrix.items())
+    return repr((matrix, parameters.left_padding, parameters.right_padding))
+
+
+class RegionCache:
+    """On-disk cache of the intermediate results of
+    MaskedRegion.predict_fragments (--cache), so that reruns on the same
+    alignment(s) skip reading the alignments and only recompute the
+    stages that changed:
+
+    - the read statistics of step 01 per region, valid as long as the
+      alignment files (size, mtime and index checksum) do not change;
+    - the filtered peaks of steps 02 and 03 per region, which are also
+      keyed by the filter parameters;
+    - the {(start, stop): count} of the reads of every alignment file
+      (sample) per reference, keyed by that file only, from which the
+      regions are discovered; adding a sample to a rerun only reads the
+      new alignment.
+
+    The output options, e.g. --offset5p/--offset3p, do not affect the
+    cache. Entries of changed alignments are not removed; the directory
+    can be deleted at any time.
+    """
+    version = '2'
+
+    def __init__(self, directory, alignment_files, parameters, read_weight=None):
+        weight = [str(read_weight)] if read_weight is not None else []
+
+        # The identity of every alignment file, with the options that change its reads
+        self.samples = {}
+        for alignment_file in alignment_files:
+            self.samples[alignment_file] = [os.path.abspath(alignment_file)] + alignment_identity(alignment_file) + weight
+
+        identity = [self.version, flaimapper.__version__]
+        for alignment_file in alignment_files:
+            identity += self.samples[alignment_file]
+
+        self.root = directory
+        self.directory = os.path.join(directory, self.checksum(identity))
+        self.stats_directory = os.path.join(self.directory, 'stats')
+        self.peaks_directory = os.path.join(self.directory, 'peaks', self.checksum([parameters_identity(parameters)]))
+
+        for path in [self.stats_directory, self.peaks_directory]:
+            os.makedirs(path, exist_ok=True)
+
+        logging.info(" - Using region cache: " + self.directory)
+
+    def checksum(self, values):
+        return hashlib.sha1("\t".join(values).encode('utf-8')).hexdigest()
+
+    def filename(self, directory, region):
+        return os.path.join(directory, self.checksum([region[0], str(region[1]), str(region[2])]) + '.pickle')
+
+    def load(self, filename):
+        try:
+            with open(filename, 'rb') as fh:
+                return pickle.load(fh)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def save(self, filename, data):
+        """
+        Writes to a temporary file that is renamed afterwards, so that
+        parallel runs or workers never read incomplete entries.
+        """
+        fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            pickle.dump(data, fh, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp_filename, filename)
+
+    def load_stats(self, region):
+        return self.load(self.filename(self.stats_directory, region))
+
+    def save_stats(self, region, stats):
+        self.save(self.filename(self.stats_directory, region), stats)
+
+    def sample_filename(self, alignment_file, s_name):
+        directory = os.path.join(self.root, 'samples', self.checksum([self.version, flaimapper.__version__] + self.samples[alignment_file]))
+        os.makedirs(directory, exist_ok=True)
+
+        return os.path.join(directory, self.checksum([s_name]) + '.pickle')
+
+    def load_spans(self, alignment_file, s_name):
+        return self.load(self.sample_filename(alignment_file, s_name))
+
+    def save_spans(self, alignment_file, s_name, spans):
+        self.save(self.sample_filename(alignment_file, s_name), spans)
+
+    def load_peaks(self, region):
+        return self.load(self.filename(self.peaks_directory, region))
+
+    def save_peaks(self, region, peaks):
+        self.save(self.filename(self.peaks_directory, region), peaks)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import os
+import hashlib
+import logging
+
+from flaimapper.RegionCache import alignment_identity
+
+
+class RegionIndex:
+    """Sidecar file with the regions discovered by FlaiMapper.regions()
+    (--region-index), so that reruns on the same alignment(s) do not
+    have to walk the whole alignment to find them again.
+
+    The file is BED-like (reference, start, end; 0-based, end exclusive)
+    with a header that records what the regions were built from: the
+    alignment files (path, size, mtime and index checksum), the left
+    and right padding of the filter parameters, and the analysed
+    references. If any of these differ, the index is not used and is
+    rebuilt.
+    """
+    version = '1'
+
+    def __init__(self, filename, alignment_files, parameters, references):
+        self.filename = filename
+
+        alignments = []
+        for alignment_file in alignment_files:
+            alignments.append("\t".join([os.path.abspath(alignment_file)] + alignment_identity(alignment_file)))
+
+        self.header = ["#flaimapper-region-index\t" + self.version]
+        self.header += ["#alignment\t" + alignment for alignment in alignments]
+        self.header.append("#padding\t%i\t%i" % (parameters.left_padding, parameters.right_padding))
+        self.header.append("#references\t%i\t%s" % (len(references), hashlib.sha1("\n".join(references).encode('utf-8')).hexdigest()))
+
+    def load(self):
+        """
+        Returns the regions as (reference, start, end) tuples, as in
+        MaskedRegion.region, or None if there is no index or it was
+        built with other alignments, padding or references.
+        """
+        if not os.path.isfile(self.filename):
+            return None
+
+        header = []
+        regions = []
+        with open(self.filename, 'r') as fh:
+            for line in fh:
+                line = line.rstrip('\n')
+                if line.startswith('#'):
+                    header.append(line)
+                elif len(line) > 0:
+                    params = line.split("\t")
+                    regions.append((params[0], int(params[1]), int(params[2]) - 1))
+
+        if header != self.header:
+            logging.info(" - Region index is outdated and will be rebuilt: " + self.filename)
+            return None
+
+        logging.info(" - Using region index: " + self.filename)
+        return regions
+
+    def save(self, regions):
+        logging.info(" - Writing region index: " + self.filename)
+
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as fh:
+            fh.write("\n".join(self.header) + "\n")
+            for region in regions:
+                fh.write("%s\t%i\t%i\n" % (region[0], region[1], region[2] + 1))
+
+        os.replace(tmp_filename, self.filename)
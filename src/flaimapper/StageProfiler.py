@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import json
+import logging
+
+
+class StageProfiler:
+    """Collects the per-region profiles of MaskedRegion.predict_fragments
+    (--profile-stages) and writes them as report: a TSV file, or a JSON
+    file if the filename ends with '.json'. Both contain the profile of
+    every region, the totals per step and the top-N slowest regions.
+
+    A profile is a dict as created by MaskedRegion:
+    {'region': (name, start, end), 'reads': int, 'start_peaks': int,
+     'stop_peaks': int, 'fragments': int, 'step_01_reads': seconds,
+     'step_01_medians': seconds, 'step_02': seconds, ...}
+    """
+    steps = ['step_01_reads', 'step_01_medians', 'step_02', 'step_03', 'step_04']
+    columns = ['reads', 'start_peaks', 'stop_peaks', 'fragments']
+
+    def __init__(self, top=10):
+        self.top = top
+        self.profiles = []
+
+    def add(self, profile):
+        if profile is not None:
+            self.profiles.append(profile)
+
+    def total(self, profile):
+        return sum(profile[step] for step in self.steps)
+
+    def totals(self):
+        totals = {step: 0.0 for step in self.steps}
+        for profile in self.profiles:
+            for step in self.steps:
+                totals[step] += profile[step]
+
+        return totals
+
+    def slowest(self):
+        return sorted(self.profiles, key=self.total, reverse=True)[:self.top]
+
+    def name(self, profile):
+        return "%s:%i-%i" % tuple(profile['region'])
+
+    def write(self, filename):
+        logging.info(" - Writing stage profile of %i regions to: %s" % (len(self.profiles), filename))
+
+        with open(filename, 'w') as fh:
+            if filename.endswith('.json'):
+                self.write_json(fh)
+            else:
+                self.write_tsv(fh)
+
+        for profile in self.slowest():
+            logging.info("   %s: %.6fs" % (self.name(profile), self.total(profile)))
+
+    def write_json(self, fh):
+        def entry(profile):
+            data = {'region': self.name(profile), 'total': self.total(profile)}
+            for key in self.columns + self.steps:
+                data[key] = profile[key]
+
+            return data
+
+        json.dump({'totals': self.totals(),
+                   'slowest': [entry(profile) for profile in self.slowest()],
+                   'regions': [entry(profile) for profile in self.profiles]}, fh, indent=4, sort_keys=True)
+        fh.write("\n")
+
+    def write_tsv(self, fh):
+        totals = self.totals()
+        fh.write("# Total time per step: " + ", ".join("%s=%.6fs" % (step, totals[step]) for step in self.steps) + "\n")
+        fh.write("# Slowest regions: " + ", ".join("%s=%.6fs" % (self.name(profile), self.total(profile)) for profile in self.slowest()) + "\n")
+
+        fh.write("Region\t" + "\t".join(self.columns) + "\t" + "\t".join(self.steps) + "\ttotal\n")
+        for profile in self.profiles:
+            values = [self.name(profile)]
+            values += ["%i" % profile[key] for key in self.columns]
+            values += ["%.6f" % profile[step] for step in self.steps]
+            values.append("%.6f" % self.total(profile))
+
+            fh.write("\t".join(values) + "\n")
@@ -40,7 +40,82 @@
 import flaimapper
 
 
+def fragment_uid(reference, i):
+    """
+    Returns the uid of the i-th fragment (counted from 1) of reference,
+    as used in all output: FM_<reference>_<i, zero-padded to 12 digits>.
+    """
+    return 'FM_' + reference + '_' + str(i).zfill(12)
+
+
+# The two GTF lines of a fragment, with the source filled in once
+GTF_TEMPLATE = ("%s\t"                                          # Reference
+                "flaimapper-v" + flaimapper.__version__.replace('%', '%%') + "\t"  # Source
+                "sncdRNA\t"
+                "%i\t"                                          # Start
+                "%i\t"                                          # End
+                "%i\t"                                          # Score
+                ".\t.\t"                                        # Strand and Frame
+                'gene_id "%s"\n'                                # Attributes (gene_id only)
+                # Line 2: type exon, with offset used for counting in e.g. HTSeq-count / featureCounts
+                "%s\t"
+                "flaimapper-v" + flaimapper.__version__.replace('%', '%%') + "\t"
+                "exon\t"
+                "%i\t"
+                "%i\t"
+                "%i\t"
+                ".\t.\t"
+                'gene_id "%s"\n')
+
+
+def gtf_entry(uid, region, start, stop, supporting_reads_start, supporting_reads_stop, type_exon_offset5p, type_exon_offset3p):
+    """
+    Formats a fragment (start and stop relative to region, a tuple of
+    (reference, start, end)) as the two GTF lines of FlaiMapper: the
+    sncdRNA and the exon, of which the ends are extended by the offsets.
+    """
+    start += region[1] + 1
+    stop += region[1] + 1
+    score = supporting_reads_stop + supporting_reads_start
+
+    return GTF_TEMPLATE % (region[0], start, stop, score, uid,
+                           region[0], max(1, start - type_exon_offset5p), max(1, stop + type_exon_offset3p), score, uid)
+
+
+def table_entry(uid, region, start, stop, supporting_reads_start, supporting_reads_stop, sequence=''):
+    """
+    Formats a fragment (start and stop relative to region, a tuple of
+    (reference, start, end)) as line of the tabular output. The sequence
+    of the fragment is left empty if not given.
+    """
+    return ("%s\t"
+            "%i\t"
+            "%s\t"
+            "%i\t"
+            "%i\t"
+            "%s\t"
+            "%i\t"
+            "%i\t"
+            "%s\t"
+            "%i\t"
+            "%i\t"
+            "%i\n") % (uid,
+                       stop - start + 1,
+                       region[0],
+                       region[1] + start,
+                       region[1] + stop,
+                       region[0],
+                       start,
+                       stop,
+                       sequence,
+                       supporting_reads_start,
+                       supporting_reads_stop,
+                       supporting_reads_stop + supporting_reads_start)
+
+
 class ncRNAFragment:
+    __slots__ = ('start', 'stop', 'supporting_reads_start', 'supporting_reads_stop')
+
     def __init__(self, start, stop, supporting_reads_start, supporting_reads_stop):
         self.start = start
         self.stop = stop
@@ -49,61 +124,10 @@ class ncRNAFragment:
         self.supporting_reads_stop = supporting_reads_stop    # The reads with the end-position aligned exactly to the 3' of the fragment
 
     def to_gtf_entry(self, uid, masked_region, type_exon_offset5p, type_exon_offset3p):
-        # Line 1: type sncdRNA
-        out_str = ("%s\t"              # Reference
-                   "flaimapper-v%s\t"  # Source
-                   "sncdRNA\t"
-                   "%i\t"              # Start
-                   "%i\t"              # End
-                   "%i\t"              # Score
-                   ".\t.\t"            # Strand and Frame
-                   'gene_id "%s"\n'    # Attributes (gene_id only)
-                   ) % (masked_region.region[0],
-                        flaimapper.__version__,
-                        masked_region.region[1] + self.start + 1,
-                        masked_region.region[1] + self.stop + 1,
-                        self.supporting_reads_stop + self.supporting_reads_start,
-                        uid)
-
-        # Line 2: type exon, with offset used for counting in e.g. HTSeq-count / featureCounts
-        out_str += ("%s\t"              # Reference
-                    "flaimapper-v%s\t"  # Source
-                    "exon\t"
-                    "%i\t"              # Start
-                    "%i\t"              # End
-                    "%i\t"              # Score
-                    ".\t.\t"            # Strand and Frame
-                    'gene_id "%s"\n'    # Attributes (gene_id only)
-                    ) % (masked_region.region[0],
-                         flaimapper.__version__,
-                         max(1, masked_region.region[1] + self.start + 1 - type_exon_offset5p),
-                         max(1, masked_region.region[1] + self.stop + 1 + type_exon_offset3p),
-                         self.supporting_reads_stop + self.supporting_reads_start,
-                         uid)
-
-        return out_str
+        return gtf_entry(uid, masked_region.region, self.start, self.stop, self.supporting_reads_start, self.supporting_reads_stop, type_exon_offset5p, type_exon_offset3p)
 
     def to_table_entry(self, uid, masked_region, fasta_file):
-        return ("%s\t"
-                "%i\t"
-                "%s\t"
-                "%i\t"
-                "%i\t"
-                "%s\t"
-                "%i\t"
-                "%i\t"
-                "%s\t"
-                "%i\t"
-                "%i\t"
-                "%i\n") % (uid,
-                           self.stop - self.start + 1,
-                           masked_region.region[0],
-                           masked_region.region[1] + self.start,
-                           masked_region.region[1] + self.stop,
-                           masked_region.region[0],
-                           self.start,
-                           self.stop,
-                           fasta_file.fetch(masked_region.region[0], masked_region.region[1] + self.start, masked_region.region[1] + self.stop + 1) if fasta_file else '',
-                           self.supporting_reads_start,
-                           self.supporting_reads_stop,
-                           self.supporting_reads_stop + self.supporting_reads_start)
+        region = masked_region.region
+        sequence = fasta_file.fetch(region[0], region[1] + self.start, region[1] + self.stop + 1) if fasta_file else ''
+
+        return table_entry(uid, region, self.start, self.stop, self.supporting_reads_start, self.supporting_reads_stop, sequence)
@@ -147,6 +147,35 @@ def sort_frequency_dict(some_dict):
     return sorted_list
 
 
+def weighted_median(keys, counts):
+    """
+    Median of the list in which every key in (sorted) keys is repeated
+    by its (positive) count, found by walking over the cumulative counts.
+    If the two middle values differ their average is returned as float.
+
+    weighted_median([21, 23, 24], [2, 6, 3]) = 23
+    weighted_median([22, 26], [8, 8]) = 24.0
+    """
+    total = sum(counts)
+    if total == 0:
+        return None
+
+    lower_rank = (total - 1) // 2
+    upper_rank = total // 2
+
+    lower_key = None
+    cumulative = 0
+    for key, count in zip(keys, counts):
+        cumulative += count
+        if lower_key is None and cumulative > lower_rank:
+            lower_key = key
+        if cumulative > upper_rank:
+            if key == lower_key:
+                return key
+            else:
+                return (float(lower_key + key)) / 2
+
+
 def py2_round(x, d=0):
     p = 10 ** d
     return float(math.floor((x * p) + math.copysign(0.5, x))) / p
@@ -1,3 +1,3 @@
 #!/bin/bash
 
-flake8 --ignore=E501 *.py flaimapper/*.py tests/*.py bin/*
+flake8 --ignore=E501 *.py flaimapper/*.py tests/*.py benchmarks/*.py bin/*
@@ -57,8 +57,8 @@ setup(name='flaimapper',
       include_package_data=True,
 
       # Very severe backwards incompatibility in 0.9 and above
-      setup_requires=['pysam >= 0.14.1', 'nose', 'flake8'],
-      install_requires=['pysam >= 0.14.1'],
+      setup_requires=['pysam >= 0.14.1', 'numpy', 'nose', 'flake8'],
+      install_requires=['pysam >= 0.14.1', 'numpy'],
 
       test_suite="tests",
 
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import flaimapper
+import unittest
+import filecmp
+import os
+import logging
+import collections
+
+import pysam
+
+from flaimapper.MultiSample import MultiSampleFlaiMapper
+from flaimapper.BAMParser import BAMParser
+from flaimapper.BAMParser import ReadWeight
+from flaimapper.BAMParser import read_span
+from benchmarks.synthetic import SyntheticAlignment
+from tests.utils import FlaiMapperTestCase
+
+
+logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
+
+
+class TestBAMParser(FlaiMapperTestCase):
+    def collapse(self, expanded, collapsed):
+        """
+        Writes the identical alignments of expanded as one alignment
+        with the number of reads as '_x123' suffix and as XC tag.
+        """
+        with pysam.AlignmentFile(expanded, 'rb') as alignment_file:
+            runs = []
+            for read in alignment_file.fetch():
+                key = (read.reference_id, read.reference_start, read.cigarstring)
+                if len(runs) > 0 and runs[-1][0] == key:
+                    runs[-1][2] += 1
+                else:
+                    runs.append([key, read, 1])
+
+            with pysam.AlignmentFile(collapsed, 'wb', header=alignment_file.header) as fh:
+                for key, read, count in runs:
+                    read.query_name = read.query_name + '_x' + str(count)
+                    read.set_tag('XC', count)
+                    fh.write(read)
+
+        pysam.index(collapsed)
+
+        return len(runs)
+
+    def test_01(self):
+        """
+        ReadWeight takes the count from the tag first, then from the
+        name, and counts other alignments as 1.
+        """
+        header = pysam.AlignmentHeader.from_dict({'SQ': [{'SN': 'chr1', 'LN': 100}]})
+        read = pysam.AlignedSegment(header)
+        read.query_name = 'read_1_x12'
+
+        self.assertEqual(ReadWeight('XC')(read), 1)
+        self.assertEqual(ReadWeight(None, True)(read), 12)
+        read.set_tag('XC', 3)
+        self.assertEqual(ReadWeight('XC', True)(read), 3)
+
+        read.query_name = 'read_1'
+        self.assertEqual(ReadWeight(None, True)(read), 1)
+
+    def test_02(self):
+        """
+        A collapsed alignment, with the counts in the read names or in a
+        tag, must give the same annotation as the expanded alignment.
+        """
+        expanded = SyntheticAlignment(chromosomes=2, chromosome_length=5000, clusters=4, depth=200, seed=5).write('tmp/test_BAMParser_test_02_expanded.bam')
+        collapsed = 'tmp/test_BAMParser_test_02_collapsed.bam'
+        n_collapsed = self.collapse(expanded, collapsed)
+
+        with pysam.AlignmentFile(expanded, 'rb') as alignment_file:
+            self.assertLess(n_collapsed, alignment_file.mapped)
+
+            region = ('chr1', 0, 5000)
+            self.assertEqual(sum(read[2] for read in BAMParser(region, collapsed, ReadWeight('XC')).parse_spans()), len(list(BAMParser(region, alignment_file))))
+
+        fname_ref = 'tmp/test_BAMParser_test_02_ref.gtf'
+        fname = 'tmp/test_BAMParser_test_02.gtf'
+        self.run_flaimapper([expanded, '-o', fname_ref])
+
+        for argv in [['--weight-name'], ['--weight-tag', 'XC'], ['--weight-tag', 'XC', '--single-pass'], ['--weight-name', '--threads', '2']]:
+            self.run_flaimapper([collapsed, '-o', fname] + argv)
+            self.assertEqualFiles(fname_ref, fname)
+
+        # Without the weights the annotation is different
+        self.run_flaimapper([collapsed, '-o', fname])
+        self.assertFalse(filecmp.cmp(fname_ref, fname))
+
+        # Multiple samples, including the support per sample
+        self.run_flaimapper([expanded, expanded, '-o', fname_ref], MultiSampleFlaiMapper)
+        self.run_flaimapper([collapsed, collapsed, '-o', fname, '--weight-name'], MultiSampleFlaiMapper)
+        self.assertEqualFiles(fname_ref, fname)
+        with open(fname_ref + '.support.tsv', 'r') as fh_ref, open(fname + '.support.tsv', 'r') as fh:
+            self.assertEqual(fh_ref.readlines()[1:], fh.readlines()[1:])
+
+        for filename in [expanded, expanded + '.bai', collapsed, collapsed + '.bai', fname_ref, fname, fname_ref + '.support.tsv', fname + '.support.tsv']:
+            os.remove(filename)
+
+    def test_03(self):
+        """
+        parse_spans must give every distinct span once, with the number
+        of reads of parse_reads with that span.
+        """
+        expanded = SyntheticAlignment(chromosomes=1, chromosome_length=5000, clusters=4, depth=300, seed=7).write('tmp/test_BAMParser_test_03.bam')
+        region = ('chr1', 1000, 3000)
+
+        spans = list(BAMParser(region, expanded).parse_spans())
+        self.assertEqual(len(spans), len(set((start, stop) for start, stop, count in spans)))
+        self.assertEqual({(start, stop): count for start, stop, count in spans}, collections.Counter(BAMParser(region, expanded)))
+        self.assertLess(len(spans), sum(count for start, stop, count in spans))
+
+        os.remove(expanded)
+        os.remove(expanded + '.bai')
+
+    def test_04(self):
+        """
+        read_span and parse_spans must give the ends of read.blocks,
+        also for spliced, clipped, deleted and unaligned reads, and skip
+        reads without blocks. A leading deletion or skip gives the
+        same span as reads starting later, which parse_spans must merge.
+        """
+        header = pysam.AlignmentHeader.from_dict({'SQ': [{'SN': 'chr1', 'LN': 1000}]})
+        bam = 'tmp/test_BAMParser_test_04.bam'
+        fh = pysam.AlignmentFile(bam, 'wb', header=header)
+        expected = collections.Counter()
+
+        # Not included: CIGARs ending with a deletion or skip that is balanced by insertions (e.g. 10M2I2D), see read_span()
+        for reference_start, cigar in [(100, _) for _ in ['22M', '3S20M2S', '5H3S10M', '10M100N12M', '10M2D12M', '10M2I12M', '10M2D', '4I10M', '2D10M', '10=2X3M', '10M50N', '3S8I', '5D', '1I', '2S1I', '1M']] + [(101, '1D10M'), (102, '10M')]:
+            read = pysam.AlignedSegment(header)
+            read.query_name = cigar
+            read.reference_id = 0
+            read.reference_start = reference_start
+            read.cigarstring = cigar
+            read.query_sequence = 'A' * read.infer_query_length()
+
+            blocks = read.blocks
+            self.assertEqual(read_span(read), (blocks[0][0], blocks[-1][1] - 1) if len(blocks) > 0 else None, msg=cigar)
+
+            fh.write(read)
+            if len(blocks) > 0:
+                expected[(blocks[0][0], blocks[-1][1] - 1)] += 1
+
+        # The check inlined in parse_spans
+        fh.close()
+        pysam.index(bam)
+        spans = list(BAMParser(('chr1', 0, 1000), bam).parse_spans())
+        self.assertEqual([_[0] for _ in spans], sorted(_[0] for _ in spans))
+        self.assertEqual({(start, stop): count for start, stop, count in spans}, expected)
+        self.assertEqual(expected[(102, 111)], 3)
+        os.remove(bam)
+        os.remove(bam + '.bai')
+
+        read = pysam.AlignedSegment(header)
+        read.is_unmapped = True
+        self.assertIsNone(read_span(read))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -40,9 +40,13 @@ import flaimapper
 import unittest
 import filecmp
 import os
+import json
 import logging
 
+import pysam
+
 from flaimapper.FlaiMapper import FlaiMapper
+from flaimapper.BAMParser import BAMParser
 from flaimapper.CLI import CLI
 from flaimapper.utils import get_file_diff
 from flaimapper.Data import TESTS_EXAMPLE_ALIGNMENT_01
@@ -52,6 +56,8 @@ from flaimapper.Data import TESTS_FLAIMAPPER_TEST_03_a_OUTPUT_TXT
 from flaimapper.Data import TESTS_FLAIMAPPER_TEST_03_b_OUTPUT_TXT
 from flaimapper.Data import TESTS_FUNCTIONAL_DUCK26_PARAMS
 from flaimapper.Data import TESTS_FUNCTIONAL_DUCK7_PARAMS
+from flaimapper.Data import TESTS_FUNCTIONAL_TEST_05
+from flaimapper.Data import TESTS_FUNCTIONAL_TEST_05_OUTPUT_TXT
 
 
 logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
@@ -438,6 +444,217 @@ class TestFlaiMapper(unittest.TestCase):
 
         self.assertEqual(i, 2)
 
+    def test_05_a(self):
+        """
+        Single-pass mode must give the same statistics and thus the same
+        output as fetching the reads per region.
+        """
+        fname = 'test_FlaiMapper_test_05_a_output.txt'
+        args = CLI([TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname, '-f', '1', '--single-pass', '--verbose', '--offset5p', '4', '--offset3p', '4'])
+
+        flaimapper = FlaiMapper(args)
+
+        for region in flaimapper.regions():
+            self.assertTrue(region.spans is not None)
+            self.assertEqual(sum(region.spans.values()), len(list(BAMParser(region.region, args.alignment_file))))
+
+        # Run analysis
+        flaimapper.run()
+
+        # assert Contents:
+        self.assertTrue(filecmp.cmp(TESTS_FLAIMAPPER_TEST_03_a_OUTPUT_TXT, fname), msg="diff '" + TESTS_FLAIMAPPER_TEST_03_a_OUTPUT_TXT + "' '" + fname + "':\n" + get_file_diff(TESTS_FLAIMAPPER_TEST_03_a_OUTPUT_TXT, fname))
+
+        os.remove(fname)
+
+    def test_05_b(self):
+        fname = 'test_FlaiMapper_test_05_b_output.txt'
+        args = CLI([TESTS_FUNCTIONAL_TEST_05, '-o', fname, '-f', '1', '--single-pass'])
+
+        flaimapper = FlaiMapper(args)
+        flaimapper.run()
+
+        self.assertTrue(filecmp.cmp(TESTS_FUNCTIONAL_TEST_05_OUTPUT_TXT, fname), msg="diff '" + TESTS_FUNCTIONAL_TEST_05_OUTPUT_TXT + "' '" + fname + "':\n" + get_file_diff(TESTS_FUNCTIONAL_TEST_05_OUTPUT_TXT, fname))
+
+        os.remove(fname)
+
+    def test_06(self):
+        """
+        The regions must share a single alignment handle, instead of
+        opening the BAM file once per region.
+        """
+        args = CLI([TESTS_EXAMPLE_ALIGNMENT_01, '-o', 'test_FlaiMapper_test_06_output.gtf'])
+
+        fm = FlaiMapper(args)
+        opens = fm.pool.opens
+
+        n_regions = len(list(fm.regions()))
+        self.assertTrue(n_regions > 1)
+
+        fm.run()
+        self.assertEqual(fm.pool.opens, opens + 1)
+
+        os.remove('test_FlaiMapper_test_06_output.gtf')
+
+    def test_07(self):
+        """
+        Running the regions in a process pool must give output identical
+        to the serial run.
+        """
+        fname = 'test_FlaiMapper_test_07_output.gtf'
+        args = CLI([TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname, '--threads', '2', '--offset5p', '4', '--offset3p', '4'])
+
+        flaimapper = FlaiMapper(args)
+        flaimapper.run()
+
+        self.assertTrue(
+            filecmp.cmp(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname),
+            msg="diff '" + TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF + "' '" + fname + "':\n" + get_file_diff(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname))
+
+        os.remove(fname)
+
+    def test_08(self):
+        """
+        --profile-stages must not change the output, and report every
+        region, serial and in a process pool, with the reading of the
+        alignments and the medians of step 01 as separate columns.
+        """
+        fname = 'test_FlaiMapper_test_08_output.gtf'
+
+        for threads, profile in [('1', 'test_FlaiMapper_test_08_profile.tsv'), ('2', 'test_FlaiMapper_test_08_profile.json')]:
+            args = CLI([TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname, '--threads', threads, '--offset5p', '4', '--offset3p', '4', '--profile-stages', profile])
+
+            flaimapper = FlaiMapper(args)
+            n_regions = len(list(flaimapper.regions()))
+            flaimapper.run()
+
+            self.assertTrue(
+                filecmp.cmp(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname),
+                msg="diff '" + TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF + "' '" + fname + "':\n" + get_file_diff(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname))
+
+            with open(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, 'r') as fh:
+                n_fragments = len(fh.readlines()) // 2
+
+            if profile.endswith('.json'):
+                with open(profile, 'r') as fh:
+                    regions = json.load(fh)['regions']
+                fragments = sum(region['fragments'] for region in regions)
+                columns = list(regions[0].keys())
+            else:
+                with open(profile, 'r') as fh:
+                    lines = [line.rstrip('\n').split('\t') for line in fh if line[0] != '#']
+                regions = lines[1:]
+                fragments = sum(int(region[lines[0].index('fragments')]) for region in regions)
+                columns = lines[0]
+
+            self.assertEqual(len(regions), n_regions)
+            self.assertEqual(fragments, n_fragments)
+            for column in ['step_01_reads', 'step_01_medians', 'step_02', 'step_03', 'step_04']:
+                self.assertIn(column, columns)
+
+            os.remove(fname)
+            os.remove(profile)
+
+    def test_09(self):
+        """
+        References without reads according to the index must be skipped,
+        and with --threads the references with most reads must be
+        predicted first while the output keeps the header order.
+        """
+        bam = 'test_FlaiMapper_test_09.bam'
+        fname = 'test_FlaiMapper_test_09_output.gtf'
+        fname_threads = 'test_FlaiMapper_test_09_output_threads.gtf'
+
+        # chr2 (1 read) before chr1 (4 reads), with empty references around them
+        with pysam.AlignmentFile(TESTS_EXAMPLE_ALIGNMENT_01, 'rb') as alignment_file:
+            header = alignment_file.header.to_dict()
+            lengths = dict(zip(alignment_file.references, alignment_file.lengths))
+            header['SQ'] = [{'SN': s_name, 'LN': lengths.get(s_name, 1000)} for s_name in ['empty_1', 'chr2', 'empty_2', 'chr1']]
+            with pysam.AlignmentFile(bam, 'wb', header=header) as fh:
+                for s_name in ['chr2', 'chr1']:
+                    for read in alignment_file.fetch(s_name):
+                        read = pysam.AlignedSegment.fromstring(read.to_string(), fh.header)
+                        fh.write(read)
+        pysam.index(bam)
+
+        fm = FlaiMapper(CLI([bam, '-o', fname]))
+        self.assertEqual(fm.work_references(), ['chr2', 'chr1'])
+        self.assertEqual(sorted(set(region.region[0] for region in fm.regions())), ['chr1', 'chr2'])
+        fm.run()
+
+        fm = FlaiMapper(CLI([bam, '-o', fname_threads, '--threads', '2']))
+        self.assertEqual(fm.work_references(), ['chr1', 'chr2'])
+        self.assertEqual([region.region[0] for region in fm.regions()][0], 'chr1')
+        fm.run()
+
+        self.assertTrue(filecmp.cmp(fname, fname_threads), msg="diff '" + fname + "' '" + fname_threads + "':\n" + get_file_diff(fname, fname_threads))
+        with open(fname, 'r') as fh:
+            self.assertEqual(fh.readline().split("\t")[0], 'chr2')
+
+        for filename in [bam, bam + '.bai', fname, fname_threads]:
+            os.remove(filename)
+
+    def test_10(self):
+        """
+        in_reference_order must restore the header order of predictions
+        of which the references come in another order.
+        """
+        class Region:
+            def __init__(self, region):
+                self.region = region
+
+        class Mapper(FlaiMapper):
+            def __init__(self):
+                pass
+
+            def references(self):
+                return ['a', 'b', 'c', 'd']
+
+            def work_references(self):
+                return ['c', 'a', 'd', 'b']
+
+        predictions = [(Region((s_name, i, i + 10)), iter([s_name + str(i)])) for s_name, i in [('c', 1), ('c', 2), ('a', 1), ('d', 1), ('d', 2), ('b', 1)]]
+        ordered = [(region.region, list(fragments)) for region, fragments in Mapper().in_reference_order(iter(predictions))]
+
+        self.assertEqual(ordered, [(('a', 1, 11), ['a1']), (('b', 1, 11), ['b1']), (('c', 1, 11), ['c1']), (('c', 2, 12), ['c2']), (('d', 1, 11), ['d1']), (('d', 2, 12), ['d2'])])
+
+    def test_11(self):
+        """
+        A reference with reads but without regions (only insertions)
+        must not hold back the predictions of the references after it.
+        """
+        bam = 'test_FlaiMapper_test_11.bam'
+        header = {'HD': {'VN': '1.0', 'SO': 'coordinate'}, 'SQ': [{'SN': s_name, 'LN': 1000} for s_name in ['chr1', 'insertions', 'chr2', 'chr3']]}
+        with pysam.AlignmentFile(bam, 'wb', header=header) as fh:
+            for s_name, cigar in [('chr1', '11M'), ('insertions', '3S8I'), ('chr2', '11M'), ('chr3', '11M')]:
+                for i in range(5):
+                    read = pysam.AlignedSegment(fh.header)
+                    read.query_name = s_name + '_' + str(i)
+                    read.reference_name = s_name
+                    read.reference_start = 100
+                    read.cigarstring = cigar
+                    read.query_sequence = 'ACGTACGTACG'
+                    fh.write(read)
+        pysam.index(bam)
+
+        fm = FlaiMapper(CLI([bam]))
+        self.assertEqual(fm.work_references(), ['chr1', 'insertions', 'chr2', 'chr3'])
+        self.assertEqual([region.region[0] for region in fm.regions()], ['chr1', 'chr2', 'chr3'])
+
+        # Every prediction must be passed on before the next one is taken
+        taken = []
+
+        def predictions():
+            for region in fm.regions():
+                taken.append(region.region[0])
+                yield region, iter([])
+
+        for i, (region, fragments) in enumerate(fm.in_reference_order(predictions())):
+            self.assertEqual(len(taken), i + 1)
+        self.assertEqual(taken, ['chr1', 'chr2', 'chr3'])
+
+        for filename in [bam, bam + '.bai']:
+            os.remove(filename)
+
 
 def main():
     unittest.main()
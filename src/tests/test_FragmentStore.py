@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import flaimapper
+import unittest
+import filecmp
+import os
+import logging
+
+from flaimapper.FlaiMapper import FlaiMapper
+from flaimapper.FragmentStore import FragmentStore
+from flaimapper.FragmentWriter import GTFWriter
+from flaimapper.FragmentWriter import TableWriter
+from flaimapper.ncRNAFragment import ncRNAFragment
+from flaimapper.CLI import CLI
+from flaimapper.utils import get_file_diff
+from flaimapper.Data import TESTS_EXAMPLE_ALIGNMENT_01
+from flaimapper.Data import TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF
+from flaimapper.Data import TESTS_FLAIMAPPER_TEST_03_a_OUTPUT_TXT
+
+
+logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
+
+
+class TestFragmentStore(unittest.TestCase):
+    def test_01(self):
+        """
+        The store must grow and give the fragments back as ncRNAFragment
+        """
+        store = FragmentStore(capacity=1)
+        store.add_region(('chr1', 10, 100), [ncRNAFragment(5, 25, 3, 4), ncRNAFragment(30, 50, 1, 2)])
+        store.add_region(('chr2', 0, 50), [])
+        store.add_region(('chr2', 60, 120), [ncRNAFragment(1, 22, 7, 8)])
+
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.regions, [('chr1', 10, 100), ('chr2', 0, 50), ('chr2', 60, 120)])
+
+        fragment = store[-1]
+        self.assertTrue(isinstance(fragment, ncRNAFragment))
+        self.assertEqual((fragment.start, fragment.stop, fragment.supporting_reads_start, fragment.supporting_reads_stop), (1, 22, 7, 8))
+
+        self.assertEqual([(region, fragment.start) for region, fragment in store], [(('chr1', 10, 100), 5), (('chr1', 10, 100), 30), (('chr2', 60, 120), 1)])
+        self.assertEqual([row[0] for row in store.rows()], ['FM_chr1_000000000001', 'FM_chr1_000000000002', 'FM_chr2_000000000001'])
+
+        with self.assertRaises(IndexError):
+            store[3]
+
+    def test_02(self):
+        """
+        Batch serialization of the collected fragments must be identical
+        to the output of FlaiMapper.run
+        """
+        args = CLI([TESTS_EXAMPLE_ALIGNMENT_01, '--offset5p', '4', '--offset3p', '4'])
+        store = FlaiMapper(args).collect()
+
+        fname = 'test_FragmentStore_test_02_output.gtf'
+        writer = GTFWriter(fname, args.offset5p, args.offset3p)
+        store.write(writer)
+        writer.close()
+
+        self.assertTrue(filecmp.cmp(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname), msg="diff '" + TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF + "' '" + fname + "':\n" + get_file_diff(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname))
+        os.remove(fname)
+
+        fname = 'test_FragmentStore_test_02_output.txt'
+        writer = TableWriter(fname, None)
+        store.write(writer)
+        writer.close()
+
+        self.assertTrue(filecmp.cmp(TESTS_FLAIMAPPER_TEST_03_a_OUTPUT_TXT, fname), msg="diff '" + TESTS_FLAIMAPPER_TEST_03_a_OUTPUT_TXT + "' '" + fname + "':\n" + get_file_diff(TESTS_FLAIMAPPER_TEST_03_a_OUTPUT_TXT, fname))
+        os.remove(fname)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import flaimapper
+import unittest
+import gzip
+import io
+import os
+import sys
+import logging
+
+import pysam
+
+from flaimapper.FlaiMapper import FlaiMapper
+from flaimapper.FragmentWriter import GTFWriter
+from flaimapper.FragmentWriter import load_columns
+from flaimapper.FragmentWriter import RegionSequences
+from flaimapper.CLI import CLI
+from flaimapper.Data import TESTS_EXAMPLE_ALIGNMENT_01
+from flaimapper.Data import TESTS_FLAIMAPPER_FA
+from flaimapper.Data import TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF
+from flaimapper.Data import TESTS_FLAIMAPPER_TEST_03_a_OUTPUT_TXT
+from flaimapper.Data import TESTS_FLAIMAPPER_TEST_03_b_OUTPUT_TXT
+
+
+logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
+
+
+class TestFragmentWriter(unittest.TestCase):
+    def test_01(self):
+        """
+        Compressed output (selected by the extension) must decompress to
+        the uncompressed output
+        """
+        for fmt, expected, fname in [('2', TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, 'test_FragmentWriter_test_01.gtf.gz'),
+                                     ('2', TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, 'test_FragmentWriter_test_01.gtf.bgz'),
+                                     ('1', TESTS_FLAIMAPPER_TEST_03_a_OUTPUT_TXT, 'test_FragmentWriter_test_01.txt.gz')]:
+            args = CLI([TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname, '-f', fmt, '--offset5p', '4', '--offset3p', '4'])
+            FlaiMapper(args).run()
+
+            with open(expected, 'r') as fh:
+                expected_content = fh.read()
+            with gzip.open(fname, 'rt') as fh:
+                self.assertEqual(fh.read(), expected_content, msg=fname)
+
+            os.remove(fname)
+
+    def test_02(self):
+        """
+        Writing to stdout must not close it, also when the buffer is
+        flushed multiple times
+        """
+        args = CLI([TESTS_EXAMPLE_ALIGNMENT_01, '--offset5p', '4', '--offset3p', '4'])
+        regions = [(region.region, list(region)) for region in FlaiMapper(args).regions()]
+
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            writer = GTFWriter('-', args.offset5p, args.offset3p)
+            writer.buffer_size = 1
+            for region, fragments in regions:
+                writer.write(region, fragments)
+            writer.close()
+
+            self.assertFalse(sys.stdout.closed)
+            content = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+        with open(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, 'r') as fh:
+            self.assertEqual(content, fh.read())
+        self.assertEqual(writer.fragments, content.count('\tsncdRNA\t'))
+
+    def test_03(self):
+        """
+        --format gtf.gz must write the GTF entries sorted by coordinate
+        and indexed by tabix
+        """
+        fname = 'test_FragmentWriter_test_03.gtf.gz'
+        args = CLI([TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname, '-f', 'gtf.gz', '--offset5p', '4', '--offset3p', '4'])
+        self.assertEqual(args.format, 'gtf.gz')
+
+        FlaiMapper(args).run()
+
+        with open(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, 'r') as fh:
+            expected = fh.readlines()
+        with gzip.open(fname, 'rt') as fh:
+            lines = fh.readlines()
+
+        self.assertEqual(sorted(lines), sorted(expected))
+        for reference in set(line.split('\t')[0] for line in lines):
+            starts = [int(line.split('\t')[3]) for line in lines if line.split('\t')[0] == reference]
+            self.assertEqual(starts, sorted(starts))
+
+        tabix = pysam.TabixFile(fname)
+        for line in expected:
+            params = line.split('\t')
+            self.assertTrue(line.rstrip('\n') in list(tabix.fetch(params[0], int(params[3]) - 1, int(params[4]))))
+        tabix.close()
+
+        os.remove(fname)
+        os.remove(fname + '.tbi')
+
+    def test_04(self):
+        """
+        The columnar output (-f 3) must contain the values of the tabular
+        output, and load memory-mapped
+        """
+        fname = 'test_FragmentWriter_test_04.npz'
+        args = CLI([TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname, '-f', '3', '--fasta', TESTS_FLAIMAPPER_FA])
+        FlaiMapper(args).run()
+
+        columns = load_columns(fname)
+        self.assertFalse(columns['start'].flags.owndata)
+
+        with open(TESTS_FLAIMAPPER_TEST_03_b_OUTPUT_TXT, 'r') as fh:
+            rows = [line.rstrip('\n').split('\t') for line in fh][1:]
+
+        self.assertEqual(len(rows), len(columns['uid']))
+        for i, row in enumerate(rows):
+            self.assertEqual(row[0], columns['uid'][i].decode())
+            self.assertEqual(row[2], str(columns['reference_names'][columns['reference'][i]]))
+            self.assertEqual(row[8], columns['sequence'][i].decode())
+            for j, column in [(1, 'size'), (3, 'start'), (4, 'end'), (6, 'start_in_precursor'), (7, 'end_in_precursor'), (9, 'reads_start'), (10, 'reads_end'), (11, 'reads_total')]:
+                self.assertEqual(int(row[j]), int(columns[column][i]), msg=column)
+
+        del columns
+        os.remove(fname)
+
+    def test_05(self):
+        """
+        Fragment sequences sliced from the region sequence must equal
+        those fetched directly, and regions must be fetched only once
+        while they are cached
+        """
+        class CountingFasta:
+            def __init__(self, fasta_file):
+                self.fasta_file = fasta_file
+                self.fetches = 0
+
+            def fetch(self, *args):
+                self.fetches += 1
+                return self.fasta_file.fetch(*args)
+
+        fasta_file = pysam.FastaFile(TESTS_FLAIMAPPER_FA)
+        counting_fasta = CountingFasta(fasta_file)
+        sequences = RegionSequences(counting_fasta, 2)
+
+        reference = fasta_file.references[0]
+        regions = [(reference, 0, 30), (reference, 5, fasta_file.get_reference_length(reference) + 20)]
+        for region in regions:
+            for start in range(0, region[2] - region[1] + 1, 3):
+                for stop in range(start, region[2] - region[1] + 1, 4):
+                    self.assertEqual(sequences.fetch(region, start, stop), fasta_file.fetch(region[0], region[1] + start, region[1] + stop + 1))
+        self.assertEqual(counting_fasta.fetches, 2)
+
+        sequences.fetch(regions[0], 0, 1)
+        self.assertEqual(counting_fasta.fetches, 2)
+
+        sequences.fetch((reference, 1, 2), 0, 1)
+        sequences.fetch(regions[1], 0, 1)
+        self.assertEqual(counting_fasta.fetches, 4)
+
+        fasta_file.close()
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
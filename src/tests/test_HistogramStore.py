@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import flaimapper
+import unittest
+import filecmp
+import os
+import shutil
+import logging
+
+import numpy
+
+from flaimapper.FlaiMapper import FlaiMapper
+from flaimapper.HistogramStore import HistogramStore
+from flaimapper.CLI import CLI
+from flaimapper.utils import get_file_diff
+from flaimapper.Data import TESTS_EXAMPLE_ALIGNMENT_01
+from flaimapper.Data import TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF
+
+
+logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
+
+
+class TestHistogramStore(unittest.TestCase):
+    def random_reads(self, rng, n, k):
+        pos_start = rng.integers(0, n - 40, k)
+        lengths = rng.integers(15, 40, k)
+        counts = rng.integers(1, 5, k)
+
+        return pos_start, pos_start + lengths, lengths, counts
+
+    def test_01(self):
+        """
+        Chunks added to a store that spills to disk, with lengths that
+        widen the matrices, must give the same counts as the sparse
+        statistics in memory.
+        """
+        spill_dir = 'tmp/test_HistogramStore_test_01'
+        if os.path.isdir(spill_dir):
+            shutil.rmtree(spill_dir)
+        os.mkdir(spill_dir)
+
+        rng = numpy.random.default_rng(1)
+        n = 500
+        chunks = [self.random_reads(rng, n, k) for k in [50, 200, 1, 75]]
+        chunks[2] = (numpy.array([0]), numpy.array([n - 1]), numpy.array([n - 1]), numpy.array([3]))
+
+        memory = HistogramStore(n)
+        memory.add(*[numpy.concatenate(arrays) for arrays in zip(*chunks)])
+        memory.finish()
+
+        spilled = HistogramStore(n, 4096, spill_dir)
+        for chunk in chunks:
+            spilled.add(*chunk)
+        spilled.finish()
+
+        self.assertIsInstance(spilled.start_lengths, numpy.memmap)
+        self.assertEqual(len(os.listdir(spill_dir)), 1)
+
+        for stops in [False, True]:
+            self.assertEqual(memory.positions(stops), spilled.positions(stops))
+            self.assertEqual(list(memory.lengths(stops)), list(spilled.lengths(stops)))
+
+        memory.close()
+        spilled.close()
+        self.assertEqual(os.listdir(spill_dir), [])
+        os.rmdir(spill_dir)
+
+    def test_02(self):
+        """
+        A region without reads, and the lengths as seen from the stop
+        positions.
+        """
+        for budget in [None, 64]:
+            store = HistogramStore(10, budget)
+            store.finish()
+            self.assertEqual(store.positions(), {})
+            self.assertEqual(list(store.lengths(stops=True)), [])
+            store.close()
+
+        store = HistogramStore(10)
+        store.add(numpy.array([1, 1, 2]), numpy.array([4, 6, 6]), numpy.array([3, 5, 4]), numpy.array([1, 2, 1]))
+        store.finish()
+        self.assertEqual(store.positions(), {1: 3, 2: 1})
+        self.assertEqual(store.positions(stops=True), {4: 1, 6: 3})
+        self.assertEqual(list(store.lengths()), [(1, [3, 5], [1, 2]), (2, [4], [1])])
+        self.assertEqual(list(store.lengths(stops=True)), [(4, [-3], [1]), (6, [-5, -4], [2, 1])])
+        store.close()
+
+    def test_03(self):
+        """
+        FlaiMapper with a memory budget that is too small for the
+        statistics of a region must give the same output.
+        """
+        fname = 'tmp/test_HistogramStore_test_03.gtf'
+
+        for threads in ['1', '2']:
+            args = CLI([TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname, '--offset5p', '4', '--offset3p', '4', '--memory-budget', '0.002', '--threads', threads])
+            fm = FlaiMapper(args)
+            fm.run()
+
+            self.assertTrue(filecmp.cmp(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname), msg="diff '" + TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF + "' '" + fname + "':\n" + get_file_diff(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname))
+
+        os.remove(fname)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
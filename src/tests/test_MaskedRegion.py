@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import flaimapper
+import unittest
+import logging
+import random
+import operator
+
+import numpy
+
+from flaimapper.MaskedRegion import MaskedRegion
+from flaimapper.CLI import CLI
+from flaimapper.utils import sort_frequency_dict
+from flaimapper.Data import TESTS_EXAMPLE_ALIGNMENT_01
+from flaimapper.Data import TESTS_FUNCTIONAL_DUCK7_PARAMS
+
+
+logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
+
+
+def get_median_of_map_trimming(value_map_ref):
+    """Original implementation of MaskedRegion.get_median_of_map, that
+    trims the lowest and highest keys until the median remains.
+    """
+    value_map = value_map_ref.copy()
+
+    keys = sorted(value_map.keys())
+    while len(keys) > 1:
+        key_l = keys[0]
+        key_t = keys[-1]
+
+        if value_map[key_l] < value_map[key_t]:
+            value_map[key_t] -= value_map[key_l]
+            del(value_map[key_l])
+            keys.remove(key_l)
+        elif value_map[key_t] < value_map[key_l]:
+            value_map[key_l] -= value_map[key_t]
+            del(value_map[key_t])
+            keys.remove(key_t)
+        elif value_map[key_t] == value_map[key_l]:
+            if len(keys) == 2:
+                return (float(keys[0] + keys[1])) / 2
+            else:
+                del(value_map[key_l], value_map[key_t])
+                keys.remove(key_l)
+                keys.remove(key_t)
+
+    if len(keys) > 0:
+        return keys[0]
+    else:
+        return None
+
+
+def get_medians_of_map_quadratic(value_map, window=15):
+    """Original implementation of MaskedRegion.get_medians_of_map, that
+    recalculates the frame of every key after each removal.
+    """
+    ordered_keys = sorted(value_map.keys())
+    frame_medians = []
+
+    while len(ordered_keys) > 0:
+        max_element = {'median': None, 'reads': -1, 'key': None, 'remove': []}
+        for key in ordered_keys:
+            other_keys = [_ for _ in ordered_keys if (_ >= (key - window) and _ <= (key + window))]
+            subset = {_: value_map[_] for _ in other_keys}
+            valsum = sum(subset.values())
+            element = {'median': get_median_of_map_trimming(subset), 'reads': valsum, 'key': key, 'remove': other_keys}
+
+            if element['reads'] > max_element['reads']:
+                max_element = element
+            elif element['reads'] == max_element['reads'] and len(element['remove']) > len(max_element['remove']):
+                max_element = element
+            elif element['reads'] == max_element['reads'] and len(element['remove']) == len(max_element['remove']) and element['key'] < max_element['key']:
+                max_element = element
+
+        frame_medians.append(max_element['median'])
+
+        for val in max_element['remove']:
+            ordered_keys.remove(val)
+
+    return frame_medians if len(frame_medians) > 0 else None
+
+
+def smooth_filter_peaks_nested(plist, matrix):
+    """Original implementation of MaskedRegion.step_03__smooth_filter_peaks,
+    that compares every pair of peaks.
+    """
+    psorted = sorted(plist.items(), key=operator.itemgetter(1, 0), reverse=True)
+
+    n = range(len(psorted))
+
+    for i in n:
+        if(psorted[i] is not None):
+            item = psorted[i]
+            for j in n:
+                if((psorted[j] is not None) and (j != i)):
+                    item2 = psorted[j]
+                    diff = item2[0] - item[0]
+                    if diff in matrix:
+                        perc = matrix[diff] / 100.0
+                        if((perc * item[1]) > item2[1]):
+                            psorted[j] = None
+
+    return {x[0]: x[1] for x in psorted if x is not None}
+
+
+def assemble_fragments_scanning(pstart, pstop, pexpectedStart, pexpectedStop, left_padding, right_padding):
+    """Original implementation of MaskedRegion.step_04__assemble_fragments,
+    that scans all sorted keys of pstart / pstop for every expected
+    position. Yields the fragments as (start, stop, reads on start, reads
+    on stop).
+    """
+    if len(pstart) >= len(pstop):
+        pstopSorted = sort_frequency_dict(pstop)
+        for itema in pstopSorted:
+            pos = itema[0]
+            for diff in pexpectedStop[pos]:
+                predictedPos = pos + diff + 1
+
+                highest_scoring_position = (0, -1, -1, -1, -1, 99999)
+
+                for item in sorted(pstart.keys()):
+                    if item >= predictedPos - left_padding and item <= predictedPos + right_padding:
+                        distance = abs(predictedPos - item)
+                        penalty = 1.0 - (distance * 0.09)
+
+                        score = pstart[item] * penalty
+                        if (score > highest_scoring_position[0]) or (score == highest_scoring_position[0] and distance < highest_scoring_position[5]):
+                            highest_scoring_position = (score, item, pos, pstart[item], pstop[pos], distance)
+
+                if highest_scoring_position[0] > 0.0:
+                    del(pstart[highest_scoring_position[1]])
+                    yield highest_scoring_position[1:5]
+    else:
+        pstartSorted = sort_frequency_dict(pstart)
+        for itema in pstartSorted:
+            pos = itema[0]
+            for diff in pexpectedStart[pos]:
+                predictedPos = pos + diff
+
+                highest_scoring_position = (0, -1, -1, -1, -1, 99999)
+
+                for item in sorted(pstop.keys(), reverse=True):
+                    if item >= predictedPos - left_padding and item <= predictedPos + right_padding:
+                        distance = abs(predictedPos - item)
+                        penalty = 1.0 - (distance * 0.09)
+
+                        score = pstop[item] * penalty
+                        if (score > highest_scoring_position[0]) or (score == highest_scoring_position[0] and distance < highest_scoring_position[5]):
+                            highest_scoring_position = (score, pos, item, pstart[pos], pstop[item], distance)
+
+                if highest_scoring_position[0] > 0.0:
+                    del(pstop[highest_scoring_position[2]])
+                    yield highest_scoring_position[1:5]
+
+
+class TestMaskedRegion(unittest.TestCase):
+    def test_01(self):
+        masked_region = MaskedRegion(('chr1', 0, 100), None)
+
+        self.assertEqual(masked_region.get_medians_of_map({}), None)
+        self.assertEqual(masked_region.get_medians_of_map({-62: 5, -61: 63, -58: 7, -28: 23, -27: 21}), [-61, -28])
+        self.assertEqual(masked_region.get_medians_of_map({22: 8, 26: 8}), [24.0])
+
+    def test_02(self):
+        """
+        Compares the medians of the sliding window to the original
+        quadratic implementation on randomized length distributions.
+        """
+        masked_region = MaskedRegion(('chr1', 0, 100), None)
+        rng = random.Random(20181016)
+
+        for i in range(1000):
+            n_keys = rng.randint(1, 40)
+            max_count = rng.choice([1, 2, 3, 10, 1000])
+            spread = rng.choice([5, 16, 31, 60, 150])
+            sign = rng.choice([1, -1])
+
+            value_map = {}
+            for key in rng.sample(range(spread * 2), min(n_keys, spread * 2)):
+                value_map[sign * (key + 10)] = rng.randint(1, max_count)
+
+            for window in [0, 1, 15]:
+                self.assertEqual(
+                    masked_region.get_medians_of_map(value_map, window),
+                    get_medians_of_map_quadratic(value_map, window),
+                    msg=str(value_map))
+
+    def test_03(self):
+        """
+        The cumulative-count median must reproduce the trimming
+        algorithm exactly, including int vs. float results.
+        """
+        masked_region = MaskedRegion(('chr1', 0, 100), None)
+        rng = random.Random(20181017)
+
+        self.assertEqual(masked_region.get_median_of_map({}), None)
+
+        for i in range(5000):
+            value_map = {}
+            for key in rng.sample(range(-40, 40), rng.randint(1, 8)):
+                value_map[key] = rng.randint(1, rng.choice([1, 2, 5, 100]))
+
+            expected = get_median_of_map_trimming(value_map)
+            median = masked_region.get_median_of_map(value_map)
+
+            self.assertEqual(median, expected, msg=str(value_map))
+            self.assertEqual(type(median), type(expected), msg=str(value_map))
+
+    def test_04(self):
+        """
+        Rows of a length-count array must give the same medians as the
+        corresponding dicts.
+        """
+        masked_region = MaskedRegion(('chr1', 0, 100), None)
+        rng = random.Random(20181018)
+
+        for i in range(500):
+            row = numpy.zeros(rng.randint(1, 60), dtype=numpy.int64)
+            for j in rng.sample(range(len(row)), rng.randint(1, len(row))):
+                row[j] = rng.randint(1, 6)
+
+            offset = rng.randint(-80, 20)
+            value_map = {offset + j: int(row[j]) for j in range(len(row)) if row[j] > 0}
+
+            self.assertEqual(masked_region.get_median_of_map(row, offset), masked_region.get_median_of_map(value_map))
+            self.assertEqual(masked_region.get_medians_of_map(row, 15, offset), masked_region.get_medians_of_map(value_map, 15))
+            self.assertEqual(masked_region.get_medians_of_map(row, 15, offset), get_medians_of_map_quadratic(value_map, 15))
+
+    def test_05(self):
+        """
+        Compares the peak filtering by matrix offsets to the original
+        nested loop over all pairs of peaks on randomized peaks.
+        """
+        rng = random.Random(20181019)
+
+        for parameters_file in [None, TESTS_FUNCTIONAL_DUCK7_PARAMS]:
+            argv = [TESTS_EXAMPLE_ALIGNMENT_01]
+            if parameters_file is not None:
+                argv += ['--parameters', parameters_file]
+            args = CLI(argv)
+
+            masked_region = MaskedRegion(('chr1', 0, 100), args)
+            matrix = args.parameters.matrix
+
+            for i in range(1000):
+                n_peaks = rng.randint(0, 30)
+                spread = rng.choice([10, 40, 100, 400])
+                max_count = rng.choice([1, 2, 10, 1000])
+
+                plist = {}
+                for position in rng.sample(range(spread), min(n_peaks, spread)):
+                    plist[position] = rng.randint(1, max_count)
+
+                self.assertEqual(
+                    masked_region.step_03__smooth_filter_peaks(plist),
+                    smooth_filter_peaks_nested(plist, matrix),
+                    msg=str(plist))
+
+    def test_06(self):
+        """
+        Compares the assembly by bisection to the original scan over all
+        sorted positions on randomized peaks, with more start than stop
+        peaks and with more stop than start peaks.
+        """
+        rng = random.Random(20181020)
+        n_fragments = 0
+
+        for parameters_file in [None, TESTS_FUNCTIONAL_DUCK7_PARAMS]:
+            argv = [TESTS_EXAMPLE_ALIGNMENT_01]
+            if parameters_file is not None:
+                argv += ['--parameters', parameters_file]
+            args = CLI(argv)
+
+            masked_region = MaskedRegion(('chr1', 0, 100), args)
+            left_padding = args.parameters.left_padding
+            right_padding = args.parameters.right_padding
+
+            for i in range(1000):
+                spread = rng.choice([30, 60, 200])
+                max_count = rng.choice([1, 2, 10, 1000])
+                n_start = rng.randint(1, 25)
+                n_stop = rng.randint(1, 25)
+                if i % 2 == 0:  # alternate the start-heavy and stop-heavy branch
+                    n_start, n_stop = max(n_start, n_stop), min(n_start, n_stop)
+                else:
+                    n_start, n_stop = min(n_start, n_stop), max(n_start, n_stop) + 1
+
+                pstart = {position: rng.randint(1, max_count) for position in rng.sample(range(spread), n_start)}
+                pstop = {position: rng.randint(1, max_count) for position in rng.sample(range(20, spread + 20), n_stop)}
+
+                pexpectedStart = {position: [rng.randint(10, 30) for j in range(rng.randint(1, 3))] for position in pstart}
+                pexpectedStop = {position: [-rng.randint(10, 30) for j in range(rng.randint(1, 3))] for position in pstop}
+
+                fragments = [(fragment.start, fragment.stop, fragment.supporting_reads_start, fragment.supporting_reads_stop) for fragment in masked_region.step_04__assemble_fragments(pstart.copy(), pstop.copy(), pexpectedStart, pexpectedStop)]
+                expected = list(assemble_fragments_scanning(pstart.copy(), pstop.copy(), pexpectedStart, pexpectedStop, left_padding, right_padding))
+
+                self.assertEqual(fragments, expected, msg=str((pstart, pstop, pexpectedStart, pexpectedStop)))
+                n_fragments += len(fragments)
+
+        self.assertGreater(n_fragments, 2000)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import flaimapper
+import unittest
+import filecmp
+import os
+import logging
+import unittest.mock
+
+import flaimapper.MultiSample
+from flaimapper.MultiSample import MultiSampleFlaiMapper
+from flaimapper.CLI import CLI
+from flaimapper.utils import get_file_diff
+from flaimapper.Data import TESTS_EXAMPLE_ALIGNMENT_01
+from flaimapper.Data import TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF
+from benchmarks.synthetic import SyntheticAlignment
+from tests.utils import FlaiMapperTestCase
+from tests.utils import split_alignment
+
+
+logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
+
+
+class TestMultiSample(FlaiMapperTestCase):
+    def test_01(self):
+        """
+        The annotation of multiple samples must be identical to that of
+        the merged alignment, and the support per sample must add up to
+        the reads of the fragments.
+        """
+        samples = split_alignment(TESTS_EXAMPLE_ALIGNMENT_01, 3, 'tmp/test_MultiSample_test_01_')
+        fname = 'tmp/test_MultiSample_test_01.gtf'
+
+        for threads in ['1', '2']:
+            args = CLI(samples + ['-o', fname, '--offset5p', '4', '--offset3p', '4', '--threads', threads])
+            self.assertEqual(args.support_matrix, fname + '.support.tsv')
+
+            fm = MultiSampleFlaiMapper(args)
+            fm.run()
+
+            self.assertTrue(filecmp.cmp(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname), msg="diff '" + TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF + "' '" + fname + "':\n" + get_file_diff(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname))
+
+            scores = {}
+            with open(fname, 'r') as fh:
+                for line in fh:
+                    params = line.split('\t')
+                    if params[2] == 'sncdRNA':
+                        scores[params[8].split('"')[1]] = int(params[5])
+
+            with open(args.support_matrix, 'r') as fh:
+                lines = [line.rstrip('\n').split('\t') for line in fh]
+
+            self.assertEqual(lines[0], ['Fragment'] + samples)
+            self.assertEqual(len(lines) - 1, len(scores))
+            for line in lines[1:]:
+                self.assertEqual(sum(int(value) for value in line[1:]), scores[line[0]])
+
+            os.remove(fname)
+            os.remove(args.support_matrix)
+
+        for sample in samples:
+            os.remove(sample)
+            os.remove(sample + '.bai')
+
+    def test_02(self):
+        """
+        The spans of the samples read by separate processes, sent in
+        many small chunks, must give the same annotation and support as
+        a serial run, also with more threads than samples.
+        """
+        alignment = SyntheticAlignment(chromosomes=2, chromosome_length=5000, clusters=4, depth=200, seed=11).write('tmp/test_MultiSample_test_02.bam')
+        samples = split_alignment(alignment, 3, 'tmp/test_MultiSample_test_02_')
+        fname_ref = 'tmp/test_MultiSample_test_02_ref.gtf'
+        fname = 'tmp/test_MultiSample_test_02.gtf'
+
+        self.run_flaimapper(samples + ['-o', fname_ref], MultiSampleFlaiMapper)
+
+        with unittest.mock.patch.object(flaimapper.MultiSample, 'CHUNK_SIZE', 3):
+            for threads in ['3', '8']:
+                self.run_flaimapper(samples + ['-o', fname, '--threads', threads], MultiSampleFlaiMapper)
+                self.assertEqualFiles(fname_ref, fname)
+                self.assertEqualFiles(fname_ref + '.support.tsv', fname + '.support.tsv')
+
+        for filename in [alignment, alignment + '.bai'] + samples + [sample + '.bai' for sample in samples] + [fname_ref, fname, fname_ref + '.support.tsv', fname + '.support.tsv']:
+            os.remove(filename)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import flaimapper
+import unittest
+import filecmp
+import os
+import gzip
+import shutil
+import logging
+
+from flaimapper.FlaiMapper import FlaiMapper
+from flaimapper.OutputMerger import OutputMerger
+from flaimapper.CLI import CLI
+from flaimapper.CLI import CLI_merge
+from flaimapper.utils import get_file_diff
+from flaimapper.Data import TESTS_EXAMPLE_ALIGNMENT_01
+from flaimapper.Data import TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF
+from flaimapper.Data import TESTS_FLAIMAPPER_TEST_03_a_OUTPUT_TXT
+
+
+logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
+
+
+class TestOutputMerger(unittest.TestCase):
+    def run_shards(self, fmt, suffix):
+        shards = []
+        for reference in ['chr2', 'chr1']:
+            fname = 'tmp/test_OutputMerger_' + reference + suffix
+            args = CLI([TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname, '-f', fmt, '--region', reference, '--offset5p', '4', '--offset3p', '4'])
+
+            fm = FlaiMapper(args)
+            self.assertEqual(fm.references(), [reference])
+            fm.run()
+
+            shards.append(fname)
+
+        return shards
+
+    def test_01(self):
+        """
+        Merging the GTF files of shards must be identical to a single run
+        """
+        shards = self.run_shards('2', '.gtf')
+        fname = 'tmp/test_OutputMerger_test_01.gtf'
+
+        args = CLI_merge(['-o', fname, TESTS_EXAMPLE_ALIGNMENT_01] + shards)
+        merger = OutputMerger(args.alignment_file, args.format)
+        merger.merge(args.partial_outputs, args.output)
+
+        self.assertTrue(
+            filecmp.cmp(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname),
+            msg="diff '" + TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF + "' '" + fname + "':\n" + get_file_diff(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname))
+
+        for fname in shards + [fname]:
+            os.remove(fname)
+
+    def test_02(self):
+        """
+        Merging the tables of shards must be identical to a single run
+        """
+        shards = self.run_shards('1', '.txt')
+        fname = 'tmp/test_OutputMerger_test_02.txt'
+
+        args = CLI_merge(['-o', fname, '-f', '1', TESTS_EXAMPLE_ALIGNMENT_01] + shards)
+        merger = OutputMerger(args.alignment_file, args.format)
+        merger.merge(args.partial_outputs, args.output)
+
+        self.assertTrue(
+            filecmp.cmp(TESTS_FLAIMAPPER_TEST_03_a_OUTPUT_TXT, fname),
+            msg="diff '" + TESTS_FLAIMAPPER_TEST_03_a_OUTPUT_TXT + "' '" + fname + "':\n" + get_file_diff(TESTS_FLAIMAPPER_TEST_03_a_OUTPUT_TXT, fname))
+
+        for fname in shards + [fname]:
+            os.remove(fname)
+
+    def test_03(self):
+        """
+        A reference may not be present in multiple shards
+        """
+        shards = self.run_shards('2', '.gtf')
+        shutil.copy(shards[0], 'tmp/test_OutputMerger_test_03.gtf')
+        shards.append('tmp/test_OutputMerger_test_03.gtf')
+
+        merger = OutputMerger(TESTS_EXAMPLE_ALIGNMENT_01, 2)
+        with self.assertRaises(ValueError):
+            merger.merge(shards, 'tmp/test_OutputMerger_test_03.merged.gtf')
+
+        for fname in shards:
+            os.remove(fname)
+
+    def test_04(self):
+        """
+        Compressed partial outputs ('.gz', '.bgz') must give the same
+        merge as the uncompressed outputs
+        """
+        shards = self.run_shards('2', '.gtf.gz') + self.run_shards('1', '.txt.bgz')
+        fname = 'tmp/test_OutputMerger_test_04.gtf'
+
+        for fmt, expected in [('2', TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF), ('1', TESTS_FLAIMAPPER_TEST_03_a_OUTPUT_TXT)]:
+            partial_outputs = shards[:2] if fmt == '2' else shards[2:]
+            with gzip.open(partial_outputs[0], 'rb') as fh:
+                self.assertGreater(len(fh.read()), 0)
+
+            args = CLI_merge(['-o', fname, '-f', fmt, TESTS_EXAMPLE_ALIGNMENT_01] + partial_outputs)
+            merger = OutputMerger(args.alignment_file, args.format)
+            merger.merge(args.partial_outputs, args.output)
+
+            self.assertTrue(
+                filecmp.cmp(expected, fname),
+                msg="diff '" + expected + "' '" + fname + "':\n" + get_file_diff(expected, fname))
+
+        for fname in shards + [fname]:
+            os.remove(fname)
+
+    def test_05(self):
+        args = CLI([TESTS_EXAMPLE_ALIGNMENT_01, '--region', 'chr3'])
+
+        fm = FlaiMapper(args)
+        with self.assertRaises(ValueError):
+            fm.references()
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import flaimapper
+import unittest
+import os
+import shutil
+import logging
+
+from flaimapper.Data import TESTS_EXAMPLE_ALIGNMENT_01
+from flaimapper.Data import TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF
+from flaimapper.Data import TESTS_FUNCTIONAL_DUCK7_PARAMS
+from flaimapper.MultiSample import MultiSampleFlaiMapper
+from tests.utils import FlaiMapperTestCase
+from tests.utils import split_alignment
+
+
+logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
+
+
+class TestRegionCache(FlaiMapperTestCase):
+    def test_01(self):
+        """
+        Reruns with a cache must give the same output without decoding
+        the alignment again, also when the offsets change, and with
+        other filter parameters only the regions are read again.
+        """
+        cache = 'tmp/test_RegionCache_test_01_cache'
+        fname = 'tmp/test_RegionCache_test_01.gtf'
+        fname_ref = 'tmp/test_RegionCache_test_01_ref.gtf'
+        if os.path.isdir(cache):
+            shutil.rmtree(cache)
+
+        # First run fills the cache: discovery + one shared handle for the regions
+        fm = self.run_flaimapper([TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname, '--offset5p', '4', '--offset3p', '4', '--cache', cache])
+        self.assertEqual(fm.pool.opens, 2)
+        self.assertEqualFiles(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname)
+
+        # Rerun only opens the alignment for its references and index statistics
+        for threads in ['1', '2']:
+            fm = self.run_flaimapper([TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname, '--offset5p', '4', '--offset3p', '4', '--cache', cache, '--threads', threads], decode=False)
+            self.assertEqual(fm.pool.opens, 1)
+            self.assertEqualFiles(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname)
+
+        # Other offsets and other filter parameters (which change the padding, and so the regions)
+        for argv, decode in [(['--offset5p', '2', '--offset3p', '6'], False), (['-p', TESTS_FUNCTIONAL_DUCK7_PARAMS], True), (['-p', TESTS_FUNCTIONAL_DUCK7_PARAMS, '--single-pass'], False)]:
+            self.run_flaimapper([TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname_ref] + argv)
+            fm = self.run_flaimapper([TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname, '--cache', cache] + argv, decode=decode)
+            self.assertEqualFiles(fname_ref, fname)
+
+        os.remove(fname)
+        os.remove(fname_ref)
+        shutil.rmtree(cache)
+
+    def test_02(self):
+        """
+        With multiple samples the cache must be used before reading the
+        alignments, and a sample added to a rerun must be the only one
+        that is read.
+        """
+        samples = split_alignment(TESTS_EXAMPLE_ALIGNMENT_01, 3, 'tmp/test_RegionCache_test_02_')
+        cache = 'tmp/test_RegionCache_test_02_cache'
+        fname = 'tmp/test_RegionCache_test_02.gtf'
+        fname_ref = 'tmp/test_RegionCache_test_02_ref.gtf'
+        if os.path.isdir(cache):
+            shutil.rmtree(cache)
+
+        # Opening the alignments to check their index takes one handle per sample
+        for n_samples, opens in [(2, 2 + 2), (2, 2), (3, 3 + 1)]:
+            argv = samples[:n_samples] + ['--offset5p', '4', '--offset3p', '4']
+            self.run_flaimapper(argv + ['-o', fname_ref], MultiSampleFlaiMapper)
+            fm = self.run_flaimapper(argv + ['-o', fname, '--cache', cache], MultiSampleFlaiMapper, decode=opens != n_samples)
+
+            self.assertEqual(fm.pool.opens, opens)
+            self.assertEqualFiles(fname_ref, fname)
+            self.assertEqualFiles(fname_ref + '.support.tsv', fname + '.support.tsv')
+
+        for filename in [fname, fname_ref, fname + '.support.tsv', fname_ref + '.support.tsv']:
+            os.remove(filename)
+        for sample in samples:
+            os.remove(sample)
+            os.remove(sample + '.bai')
+        shutil.rmtree(cache)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import flaimapper
+import unittest
+import os
+import logging
+
+from flaimapper.MultiSample import MultiSampleFlaiMapper
+from flaimapper.Data import TESTS_EXAMPLE_ALIGNMENT_01
+from flaimapper.Data import TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF
+from flaimapper.Data import TESTS_FUNCTIONAL_DUCK7_PARAMS
+from tests.utils import FlaiMapperTestCase
+
+
+logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
+
+
+class TestRegionIndex(FlaiMapperTestCase):
+    def test_01(self):
+        """
+        The second run must take the regions from the index and give the
+        same output; other padding must rebuild the index.
+        """
+        index = 'tmp/test_RegionIndex_test_01.bed'
+        fname = 'tmp/test_RegionIndex_test_01.gtf'
+        fname_ref = 'tmp/test_RegionIndex_test_01_ref.gtf'
+        if os.path.exists(index):
+            os.remove(index)
+
+        argv = [TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname, '--offset5p', '4', '--offset3p', '4', '--region-index', index]
+        self.run_flaimapper(argv)
+        self.assertTrue(os.path.isfile(index))
+        self.assertEqualFiles(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname)
+
+        self.run_flaimapper(argv, discover=False)
+        self.assertEqualFiles(TESTS_FLAIMAPPER_TEST_02_OUTPUT_GTF, fname)
+
+        # Other padding: index is outdated
+        self.run_flaimapper([TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname_ref, '-p', TESTS_FUNCTIONAL_DUCK7_PARAMS])
+        with open(index, 'r') as fh:
+            header = [line for line in fh if line.startswith('#padding')]
+        self.run_flaimapper([TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname, '-p', TESTS_FUNCTIONAL_DUCK7_PARAMS, '--region-index', index])
+        self.assertEqualFiles(fname_ref, fname)
+        with open(index, 'r') as fh:
+            self.assertNotEqual(header, [line for line in fh if line.startswith('#padding')])
+
+        self.run_flaimapper([TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname, '-p', TESTS_FUNCTIONAL_DUCK7_PARAMS, '--region-index', index], discover=False)
+        self.assertEqualFiles(fname_ref, fname)
+
+        os.remove(index)
+        os.remove(fname)
+        os.remove(fname_ref)
+
+    def test_02(self):
+        """
+        Multiple samples: the union of the regions is indexed.
+        """
+        index = 'tmp/test_RegionIndex_test_02.bed'
+        fname = 'tmp/test_RegionIndex_test_02.gtf'
+        if os.path.exists(index):
+            os.remove(index)
+
+        argv = [TESTS_EXAMPLE_ALIGNMENT_01, TESTS_EXAMPLE_ALIGNMENT_01, '-o', fname, '--offset5p', '4', '--offset3p', '4', '--region-index', index]
+        self.run_flaimapper(argv, MultiSampleFlaiMapper)
+        fm = self.run_flaimapper(argv, MultiSampleFlaiMapper, discover=False)
+        self.assertGreater(len(fm.supports), 0)
+
+        os.remove(index)
+        os.remove(fname)
+        os.remove(fname + '.support.tsv')
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
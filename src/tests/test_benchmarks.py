@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import flaimapper
+import unittest
+import filecmp
+import os
+import logging
+
+from benchmarks.synthetic import SyntheticAlignment
+from benchmarks.bench_flaimapper import run
+from benchmarks import bench_decoding
+
+
+logging.basicConfig(format=flaimapper.__log_format__, level=logging.DEBUG)
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_01(self):
+        """
+        The synthetic alignment must be deterministic and readable by
+        the benchmarks
+        """
+        synthetic = SyntheticAlignment(chromosomes=2, chromosome_length=5000, clusters=4, depth=50, seed=3)
+
+        fname_1 = synthetic.write('tmp/test_benchmarks_01_a.bam')
+        fname_2 = synthetic.write('tmp/test_benchmarks_01_b.bam')
+        self.assertTrue(filecmp.cmp(fname_1, fname_2, shallow=False))
+
+        results, counts = run(fname_1, 1)
+
+        self.assertEqual(counts['reads'], 2 * 4 * 50)
+        self.assertTrue(counts['fragments'] > 0)
+        for name in ['FlaiMapper.regions', 'BAMParser.parse_spans', 'BAMParser.parse_reads', 'MaskedRegion.step_01__parse_stats', 'MaskedRegion.step_04__assemble_fragments', 'output.gtf', 'output.table']:
+            self.assertEqual(len(results[name]['runs']), 1)
+
+        for fname in [fname_1, fname_2]:
+            os.remove(fname)
+            os.remove(fname + '.bai')
+
+    def test_02(self):
+        """
+        The decoding micro-benchmark must decode all reads with both
+        decoders.
+        """
+        fname = SyntheticAlignment(chromosomes=1, chromosome_length=5000, clusters=4, depth=50, seed=3).write('tmp/test_benchmarks_02.bam')
+
+        results, counts = bench_decoding.run(fname, 150, 1)
+
+        self.assertEqual(counts, {'reads': 150, 'aligned': 150})
+        for name in ['blocks', 'read_span']:
+            self.assertEqual(len(results[name]['runs']), 1)
+            self.assertGreater(results[name]['reads_per_second'], 0)
+
+        os.remove(fname)
+        os.remove(fname + '.bai')
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""FlaiMapper: computational annotation of small ncRNA derived fragments using RNA-seq high throughput data
+
+ Here we present Fragment Location Annotation Identification mapper
+ (FlaiMapper), a method that extracts and annotates the locations of
+ sncRNA-derived RNAs (sncdRNAs). These sncdRNAs are often detected in
+ sequencing data and observed as fragments of their  precursor sncRNA.
+ Using small RNA-seq read alignments, FlaiMapper is able to annotate
+ fragments primarily by peak-detection on the start and  end position
+ densities followed by filtering and a reconstruction processes.
+ Copyright (C) 2011-2014:
+ - Youri Hoogstrate
+ - Elena S. Martens-Uzunova
+ - Guido Jenster
+
+
+ [License: GPL3]
+
+ This file is part of flaimapper.
+
+ flaimapper is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ flaimapper is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+ Documentation as defined by:
+ <http://epydoc.sourceforge.net/manual-fields.html#fields-synonyms>
+"""
+
+import unittest
+import unittest.mock
+import filecmp
+
+import pysam
+
+from flaimapper.FlaiMapper import FlaiMapper
+from flaimapper.BAMParser import BAMParser
+from flaimapper.CLI import CLI
+from flaimapper.utils import get_file_diff
+
+
+def split_alignment(alignment_file, n, prefix):
+    """Distributes the reads of alignment_file over n samples"""
+    filenames = [prefix + str(i) + '.bam' for i in range(n)]
+
+    with pysam.AlignmentFile(alignment_file, 'rb') as fh:
+        samples = [pysam.AlignmentFile(filename, 'wb', template=fh) for filename in filenames]
+        for i, read in enumerate(fh):
+            samples[i % n].write(read)
+
+    for sample, filename in zip(samples, filenames):
+        sample.close()
+        pysam.index(filename)
+
+    return filenames
+
+
+class FlaiMapperTestCase(unittest.TestCase):
+    """Test case with the helpers shared by the tests that run FlaiMapper
+    end-to-end and compare its output files.
+    """
+    def run_flaimapper(self, argv, cls=FlaiMapper, discover=True, decode=True):
+        """Runs FlaiMapper (or a subclass) on the command line arguments.
+
+        @param discover: if False, the run fails when it reads the regions from the alignment
+        @param decode: if False, the run fails when it decodes reads from the alignment (also in forked workers)
+        """
+        args = CLI(argv)
+        fm = cls(args)
+        if not discover:
+            fm.discover_regions = self.fail
+            fm.discover_reference = self.fail
+
+        if decode:
+            fm.run()
+        else:
+            with unittest.mock.patch.object(BAMParser, 'parse_spans', self.fail):
+                fm.run()
+
+        return fm
+
+    def assertEqualFiles(self, fname_1, fname_2):
+        self.assertTrue(filecmp.cmp(fname_1, fname_2), msg="diff '" + fname_1 + "' '" + fname_2 + "':\n" + get_file_diff(fname_1, fname_2))